@@ -0,0 +1,46 @@
+"""Compares starting automations one by one with ``Automation.bulk_start``.
+
+Both create automations without running them, as an import would hand them to the
+workers. Run with ``python benchmarks/bulk_start.py``."""
+
+import timeit
+
+from common import report, setup
+
+setup()
+
+from django.core.management import call_command  # noqa: E402
+
+from automations import flow  # noqa: E402
+from automations.models import AutomationModel  # noqa: E402
+
+
+class OnboardingAutomation(flow.Automation):
+    unique = ("email",)
+
+    start = flow.Execute(lambda task: None)
+    end = flow.End()
+
+
+def emails(offset, number):
+    return [
+        dict(email=f"customer{i}@example.com") for i in range(offset, offset + number)
+    ]
+
+
+if __name__ == "__main__":
+    call_command("migrate", verbosity=0)
+    number = 2000
+    seconds = timeit.timeit(
+        lambda: [
+            OnboardingAutomation(autorun=False, **kwargs)
+            for kwargs in emails(0, number)
+        ],
+        number=1,
+    )
+    report("Start one by one", seconds, number)
+    seconds = timeit.timeit(
+        lambda: OnboardingAutomation.bulk_start(emails(number, number)), number=1
+    )
+    report("Start with bulk_start", seconds, number)
+    assert AutomationModel.objects.count() == 2 * number
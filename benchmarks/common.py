@@ -0,0 +1,38 @@
+"""Minimal Django setup for the benchmarks (see runtests.py)"""
+
+import os
+import sys
+
+import django
+from django.conf import settings
+
+
+def setup():
+    sys.path.insert(
+        0,
+        os.path.join(
+            os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"
+        ),
+    )
+    if not settings.configured:
+        settings.configure(
+            SECRET_KEY="verysecretkeyforbenchmarking",
+            DATABASES={
+                "default": {
+                    "ENGINE": "django.db.backends.sqlite3",
+                    "NAME": ":memory:",
+                }
+            },
+            INSTALLED_APPS=(
+                "django.contrib.contenttypes",
+                "django.contrib.auth",
+                "django.contrib.sessions",
+                "automations",
+            ),
+            USE_TZ=True,
+        )
+    django.setup()
+
+
+def report(name, seconds, number):
+    print(f"{name}: {seconds / number * 1e6:.1f} µs per call ({number} calls)")
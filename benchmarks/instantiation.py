@@ -0,0 +1,51 @@
+"""Measures the cost of creating an automation instance for an existing row.
+
+This happens for every due automation in each run, for each dispatched message, and
+in the task views. Run with ``python benchmarks/instantiation.py``."""
+
+import timeit
+
+from common import report, setup
+
+setup()
+
+from django.contrib.auth.models import User  # noqa: E402
+
+from automations import flow  # noqa: E402
+from automations.flow import this  # noqa: E402
+from automations.models import AutomationModel  # noqa: E402
+
+
+class BenchmarkAutomation(flow.Automation):
+    user = User
+
+    start = flow.Execute(this.step).AsSoonAs(this.ready)
+    step1 = flow.Execute(this.step)
+    step2 = flow.If(this.ready).Then(this.step).Else(this.end)
+    step3 = flow.Execute(this.step).SkipIf(False)
+    step4 = flow.Execute(this.step)
+    step5 = flow.Execute(this.step).AfterWaitingFor(this.no_time)
+    step6 = flow.Execute(this.step)
+    step7 = flow.Execute(this.step)
+    step8 = flow.Execute(this.step)
+    end = flow.End()
+
+    def step(self, task):
+        pass
+
+    def ready(self, task):
+        return True
+
+
+if __name__ == "__main__":
+    row = AutomationModel(
+        id=1,
+        automation_class=f"{__name__}.BenchmarkAutomation",
+        finished=False,
+        data={},
+    )
+    number = 100000
+    seconds = timeit.timeit(
+        lambda: BenchmarkAutomation(automation=row, autorun=False), number=number
+    )
+    report("Instantiate automation with 10 nodes", seconds, number)
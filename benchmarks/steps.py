@@ -0,0 +1,73 @@
+"""Measures the overhead of the execution loop per node step.
+
+The first figure is the cost of reading node attributes as the execution loop does,
+the second one the time ``Automation.run`` needs per node on an in-memory database.
+Run with ``python benchmarks/steps.py``."""
+
+import timeit
+
+from common import report, setup
+
+setup()
+
+from django.core.management import call_command  # noqa: E402
+
+from automations import flow  # noqa: E402
+from automations.flow import this  # noqa: E402
+
+STEPS = 50
+
+
+class StepAutomation(flow.Automation):
+    start = flow.Execute(this.step).AsSoonAs(this.ready).SkipIf(this.skip)
+
+
+for i in range(STEPS):
+    setattr(StepAutomation, f"step{i}", flow.Execute(this.step).AsSoonAs(this.ready))
+    getattr(StepAutomation, f"step{i}").__set_name__(StepAutomation, f"step{i}")
+StepAutomation.end = flow.End()
+StepAutomation.end.__set_name__(StepAutomation, "end")
+StepAutomation.compile()
+
+
+def step(self, task):
+    pass
+
+
+def ready(self, task):
+    return True
+
+
+def skip(self, task):
+    return False
+
+
+StepAutomation.step = step
+StepAutomation.ready = ready
+StepAutomation.skip = skip
+
+
+def read_attributes(node):
+    return (
+        node._name,
+        node._next,
+        node._wait,
+        node._conditions,
+        node._skipif,
+        node._skipafter,
+        node._leave,
+        node._automation,
+    )
+
+
+if __name__ == "__main__":
+    call_command("migrate", verbosity=0)
+    atm = StepAutomation(autorun=False)
+    node = atm.step0
+    number = 200000
+    seconds = timeit.timeit(lambda: read_attributes(node), number=number)
+    report("Read 8 node attributes", seconds, number)
+
+    number = 20
+    seconds = timeit.timeit(lambda: StepAutomation().finished(), number=number)
+    report("Node step in Automation.run", seconds, number * (STEPS + 2))
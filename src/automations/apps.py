@@ -4,6 +4,7 @@ from django.conf import settings
 from django.core.checks import Error
 from django.core.checks import Tags as DjangoTags
 from django.core.checks import register
+from django.utils.module_loading import autodiscover_modules
 from django.utils.translation import gettext_lazy as _
 
 
@@ -42,3 +43,11 @@ class AutomationsConfig(AppConfig):
     def ready(self):
         super().ready()
         register(Tags.automations_settings_tag)(checks_atm_settings)
+        autodiscover_modules("automations")  # Register all automation classes
+
+        from . import settings as atm_settings
+
+        if atm_settings.METRICS:
+            from .metrics import metrics
+
+            metrics.connect()
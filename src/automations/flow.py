@@ -1,13 +1,20 @@
 # coding=utf-8
 import datetime
 import functools
+import hashlib
+import inspect
+import itertools
 import json
 import logging
 import sys
 import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
 from copy import copy
 from types import MethodType
 
+from asgiref.sync import async_to_sync, sync_to_async
 from django.conf import settings as project_settings
 from django.contrib.auth import get_user_model
 from django.core.exceptions import (
@@ -15,12 +22,13 @@ from django.core.exceptions import (
     MultipleObjectsReturned,
     ObjectDoesNotExist,
 )
-from django.db.models import Model, Q
+from django.db import IntegrityError, connection, connections
+from django.db.models import Model, Q, QuerySet
 from django.db.transaction import atomic
+from django.utils.module_loading import import_module
 from django.utils.timezone import now
-from django.views.debug import ExceptionReporter
 
-from . import models, settings
+from . import models, settings, signals
 
 """To allow forward references in Automation object "this" is defined"""
 
@@ -30,8 +38,23 @@ logger = logging.getLogger(__name__)
 
 
 def get_error_report(exc_type, exc_value, exc_traceback):
-    er = ExceptionReporter(None, exc_type, exc_value, exc_traceback)
-    return dict(error=er.get_traceback_text(), html=er.get_traceback_html())
+    """Captures the exception and its frames in a json-serializable dict. The
+    ``AutomationTracebackView`` renders it as HTML when opened."""
+    report = traceback.TracebackException(exc_type, exc_value, exc_traceback)
+    return dict(
+        error="".join(report.format()),
+        exc_type=type(exc_value).__qualname__,
+        exc_value=str(exc_value),
+        frames=[
+            dict(
+                filename=frame.filename,
+                lineno=frame.lineno,
+                function=frame.name,
+                line=frame.line,
+            )
+            for frame in report.stack
+        ],
+    )
 
 
 class ThisAttribute:
@@ -62,6 +85,23 @@ def on_execution_path(m):
     """Decorator to ensure automatic pausing of automations in
     case of WaitUntil, PauseFor and When"""
 
+    if inspect.iscoroutinefunction(m):
+
+        @functools.wraps(m)
+        async def async_wrapper(self, task, *args, **kwargs):
+            try:
+                return None if task is None else await m(self, task, *args, **kwargs)
+            except Exception as err:
+                if isinstance(err, ImproperlyConfigured):
+                    raise err
+                if task is not None:
+                    await sync_to_async(self.abort)(
+                        task, err, get_error_report(*sys.exc_info())
+                    )
+                return None
+
+        return async_wrapper
+
     @functools.wraps(m)
     def wrapper(self, task, *args, **kwargs):
         try:
@@ -70,24 +110,57 @@ def on_execution_path(m):
             if isinstance(err, ImproperlyConfigured):
                 raise err
             if task is not None:
-                self.store_result(task, repr(err), get_error_report(*sys.exc_info()))
-                self.release_lock(task)
-                self._automation._db.finished = True
-                self._automation._db.save()
-                logger.error(
-                    "Automation failed with error and was aborted", exc_info=True
-                )
+                self.abort(task, err, get_error_report(*sys.exc_info()))
             return None
 
     return wrapper
 
 
+def instrumented(phase):
+    """Decorator sending the ``signals.node_step`` signal with the duration and outcome
+    of each call. If no receiver is connected the method is just called."""
+
+    def decorator(m):
+        if inspect.iscoroutinefunction(m):
+
+            @functools.wraps(m)
+            async def async_wrapper(self, *args, **kwargs):
+                if not signals.node_step.receivers:
+                    return await m(self, *args, **kwargs)
+                start, outcome = time.perf_counter(), "error"
+                try:
+                    result = await m(self, *args, **kwargs)
+                    outcome = "stopped" if result is None else "ok"
+                    return result
+                finally:
+                    self.send_step(phase, time.perf_counter() - start, outcome)
+
+            return async_wrapper
+
+        @functools.wraps(m)
+        def wrapper(self, *args, **kwargs):
+            if not signals.node_step.receivers:
+                return m(self, *args, **kwargs)
+            start, outcome = time.perf_counter(), "error"
+            try:
+                result = m(self, *args, **kwargs)
+                outcome = "stopped" if result is None else "ok"
+                return result
+            finally:
+                self.send_step(phase, time.perf_counter() - start, outcome)
+
+        return wrapper
+
+    return decorator
+
+
 class Node:
     """Parent class for all nodes"""
 
     def __init__(self, *args, **kwargs):
         self._conditions = []
         self._next = None
+        self._jump = None  # Execution state: node to continue with instead of next
         self._wait = None
         self._skipif = []
         self._skipafter = None
@@ -111,13 +184,53 @@ class Node:
 
     @staticmethod
     def eval(sth, task):
+        if inspect.iscoroutinefunction(sth):
+            sth = async_to_sync(sth)
         return sth(task) if callable(sth) else sth
 
-    def ready(self, automation_instance, name):
-        """is called by the newly initialized Automation instance to bind the nodes to the instance."""
-        self._automation = automation_instance
+    def __set_name__(self, owner, name):
         self._name = name
-        self._conditions = [self.resolve(condition) for condition in self._conditions]
+
+    def __get__(self, instance, owner=None):
+        """Accessing a node through an automation instance returns a copy bound to the
+        instance. The copy keeps the execution state of the instance while the node
+        defined by the class stays unchanged. This way several instances of an
+        automation class can run at the same time."""
+        if instance is None:
+            return self
+        node = copy(self)
+        node.ready(instance)
+        instance.__dict__[self._name] = node  # Found before the class' node next time
+        return node
+
+    def ready(self, automation_instance, name=None):
+        """binds the node to an automation instance"""
+        self._automation = automation_instance
+        if name is not None:
+            self._name = name
+
+    def compile(self, automation_class):
+        """is called once per automation class and replaces references to other
+        nodes by their names"""
+        self._next = self.get_node_name(automation_class, self._next)
+
+    @staticmethod
+    def get_node_name(automation_class, reference):
+        if reference is None:
+            return None
+        if isinstance(reference, ThisAttribute):
+            name = reference.attr
+        elif isinstance(reference, Node):
+            name = reference._name
+        elif isinstance(reference, str):
+            name = reference[5:] if reference.startswith("self.") else reference
+        else:
+            raise ImproperlyConfigured(f"Expected reference to node, got {reference}")
+        if not isinstance(getattr(automation_class, name, None), Node):
+            raise ImproperlyConfigured(
+                f"{automation_class.__name__}.{name} is not a node"
+            )
+        return name
 
     def get_automation_name(self):
         """returns the name of the Automation instance class the node is bound to"""
@@ -127,15 +240,6 @@ class Node:
     def node_name(self):
         return self.__class__.__name__
 
-    def __getattribute__(self, item):
-        value = super().__getattribute__(item)
-        if isinstance(value, ThisAttribute) or (
-            isinstance(value, str) and value.startswith("self.")
-        ):
-            value = self.resolve(value)
-            setattr(self, item, value)  # remember
-        return value
-
     def resolve(self, value):
         if isinstance(value, ThisAttribute):  # This object?
             value = getattr(self._automation, value.attr)  # get automation attribute
@@ -145,6 +249,7 @@ class Node:
             value = getattr(self._automation, value[5:])
         return value
 
+    @instrumented("enter")
     @atomic
     def enter(self, prev_task=None):
         assert (
@@ -152,46 +257,77 @@ class Node:
         ), "Node entered w/o previous node left"
         db = self._automation._db
         assert isinstance(db, models.AutomationModel)
-        task, _ = db.automationtaskmodel_set.get_or_create(
-            previous=prev_task,
-            status=self._name,
-            defaults=self._model_defaults,
+        defaults = dict(self._model_defaults)
+        defaults.update(  # Create task locked
+            locked=defaults.get("locked", 0) + 1,
+            locked_at=now(),
+            locked_by=models.get_worker_id(),
         )
+        if prev_task is not None:  # Stay in the branch of the previous task
+            defaults.update(
+                split_id=prev_task.split_id, split_depth=prev_task.split_depth
+            )
+        task, created = self._automation.pop_open_task(prev_task, self._name), False
+        if task is None:
+            task, created = db.automationtaskmodel_set.get_or_create(
+                previous=prev_task,
+                status=self._name,
+                defaults=defaults,
+            )
         self._leave = False
-        if task.locked > 0:
+        self._jump = None
+        if not created and not task.lock():
             return None
-        task.locked += 1
-        task.save()
         return task
 
-    @atomic
     def release_lock(self, task: models.AutomationTaskModel):
-        task.locked -= 1
-        task.save()
+        task.release()
         return None
 
+    def renew_lock(self, task: models.AutomationTaskModel):
+        """Renews the lock of a task whose step took longer than half the lease.
+        Returns ``False`` if another worker has taken the lock over meanwhile."""
+        if not task.lease_expiring() or task.renew():
+            return True
+        logger.warning(f"Lock of task {self._name} ({task.id}) taken over, stopping")
+        models.UnitOfWork.discard(task)  # The other worker writes the task
+        return False
+
+    def abort(self, task: models.AutomationTaskModel, err, error_report):
+        """Stores the error and stops the automation"""
+        self.store_result(task, repr(err), error_report, artifact=True)
+        self.release_lock(task)
+        self._automation._db.finished = True
+        self._automation._db.save()
+        logger.error("Automation failed with error and was aborted", exc_info=err)
+
     @staticmethod
-    def store_result(task: models.AutomationTaskModel, message, result):
+    def store_result(task: models.AutomationTaskModel, message, result, artifact=False):
+        """Stores message and result of a task. Results that are not JSON serializable
+        are replaced by ``None``, large results (or if ``artifact`` is true) are stored
+        in an artifact."""
         task.message = message[0 : settings.MAX_FIELD_LENGTH]
-        try:  # Check if result is json serializable
-            json.dumps(result)  # Raise error if not json-serializable
-            task.result = result  # if it is, store it
+        try:
+            task.set_result(result, artifact)
         except TypeError:
-            task.result = None
+            task.set_result(None)
         task.save()
 
+    @instrumented("leave")
     def leave(self, task: models.AutomationTaskModel):
         if task is not None:
             task.finished = now()
             self.release_lock(task)
         if task is not None or self._leave:
-            if self._next is None:
-                next_node = self._automation._iter[self]
+            if self._jump is not None:
+                next_name, self._jump = self._jump, None
+            elif self._next is None:
+                next_name = self._automation._iter[self._name]
             else:
-                next_node = self._next
-            if next_node is None:
+                next_name = self._next
+            if next_name is None:
                 raise ImproperlyConfigured(f"No End() node after {self._name}")
-            return next_node
+            return getattr(self._automation, next_name)  # Bind to this automation
 
     def pause_automation(self, earliest_execution):
         if (
@@ -205,17 +341,19 @@ class Node:
             self._automation._db.paused_until = earliest_execution
 
     @on_execution_path
+    @instrumented("when")
     def when_handler(self, task):
         for condition in self._conditions:
-            if not self.eval(condition, task):
+            if not self.eval(self.resolve(condition), task):
                 return self.release_lock(task)
         return task
 
     @on_execution_path
+    @instrumented("wait")
     def wait_handler(self, task: models.AutomationTaskModel):
         if self._wait is None:
             return task
-        earliest_execution = self.eval(self._wait, task)
+        earliest_execution = self.eval(self.resolve(self._wait), task)
         if earliest_execution < now():
             return task
         self.pause_automation(earliest_execution)
@@ -223,6 +361,7 @@ class Node:
         return self.release_lock(task)
 
     @on_execution_path
+    @instrumented("skip")
     def skip_handler(self, task: models.AutomationTaskModel):
         def skip():
             task.finished = now()
@@ -232,17 +371,44 @@ class Node:
             return self.release_lock(task)
 
         if self._skipafter is not None:
-            latest_execution = task.created + self.eval(self._skipafter, task)
+            latest_execution = task.created + self.eval(
+                self.resolve(self._skipafter), task
+            )
             if latest_execution < now():
                 return skip()
         for item in self._skipif:
-            if self.eval(item, task):
+            if self.eval(self.resolve(item), task):
                 return skip()
         return task
 
     def execute(self, task: models.AutomationTaskModel):
         return self.when_handler(self.wait_handler(self.skip_handler(task)))
 
+    async def aexecute(self, task: models.AutomationTaskModel):
+        """Asynchronous version of ``execute`` used by ``Automation.arun``. By default
+        ``execute`` is run through ``sync_to_async``."""
+        return await sync_to_async(self.execute)(task)
+
+    @instrumented("execute")
+    def process(self, task: models.AutomationTaskModel):
+        """Executes the node within ``Automation.run``"""
+        return self.execute(task)
+
+    @instrumented("execute")
+    async def aprocess(self, task: models.AutomationTaskModel):
+        """Executes the node within ``Automation.arun``"""
+        return await self.aexecute(task)
+
+    def send_step(self, phase, duration, outcome):
+        signals.node_step.send(
+            sender=self._automation.__class__,
+            automation=self._automation,
+            node=self._name,
+            phase=phase,
+            duration=duration,
+            outcome=outcome,
+        )
+
     def Next(self, next_node):
         if self._next is not None:
             raise ImproperlyConfigured("Multiple .Next statements")
@@ -292,23 +458,25 @@ class End(Node):
         self._automation._db.save()
         return task
 
+    @instrumented("leave")
     def leave(self, task):
         task.finished = now()
-        task.locked = 0
-        task.save()
+        task.release(reset=True)
         return None  # Stops execution
 
 
 class Repeat(Node):
     def __init__(self, start=None, **kwargs):
-        if start is None:
-            start = self._automation.start
-
         super().__init__(**kwargs)
         self._next = start
         self._interval = None
         self._startpoint = None
 
+    def compile(self, automation_class):
+        super().compile(automation_class)
+        if self._next is None:  # Repeat from the first node
+            self._next = automation_class._iter[None]
+
     @on_execution_path
     def repeat_handler(self, task):
         if self._startpoint is None:
@@ -368,14 +536,21 @@ class Repeat(Node):
 class Split(Node):
     """Spawn several tasks which have to be joined by a Join() node"""
 
-    def __init__(self, **kwargs):
+    def __init__(self, parallel=None, **kwargs):
         super().__init__(**kwargs)
         self._splits = []
+        self._parallel = parallel
 
     def Next(self, node):
         self._splits.append(node)
         return self
 
+    def compile(self, automation_class):
+        super().compile(automation_class)
+        self._splits = [
+            self.get_node_name(automation_class, split) for split in self._splits
+        ]
+
     def execute(self, task: models.AutomationTaskModel):
         task = super().execute(task)
         if task:
@@ -386,20 +561,70 @@ class Split(Node):
             tasks = list(
                 db.automationtaskmodel_set.create(  # Create splits
                     previous=task,
-                    status=self.resolve(split)._name,
+                    status=split,
                     locked=0,
+                    split=task,
+                    split_depth=task.split_depth + 1,
                 )
                 for split in self._splits
             )
+            task.start_branches(len(tasks))
             self.store_result(task, "Split", [task.id for task in tasks])
             self.leave(task)
-            for task in tasks:
-                self._automation.run(
-                    task.previous, getattr(self._automation, task.status)
-                )  # Run other splits
+            if self.is_parallel() and len(tasks) > 1:
+                self.run_parallel(tasks)
+            else:
+                for task in tasks:
+                    self._automation.run(
+                        task.previous, getattr(self._automation, task.status)
+                    )  # Run other splits
             return None
         return task
 
+    def is_parallel(self):
+        if connection.in_atomic_block:  # Other threads cannot see the branch tasks
+            return False
+        if connection.vendor == "sqlite":  # Only one writer at a time
+            return False
+        if self._parallel is None:
+            meta = getattr(self._automation, "Meta", None)
+            return getattr(meta, "parallel_splits", False)
+        return self._parallel
+
+    def run_parallel(self, tasks):
+        """Runs the branches on a thread pool. Each branch gets an automation instance
+        and a model instance of its own sharing the run's budget. Branches write only
+        the keys of ``data`` they change, the ``Join`` merges them."""
+        automation = self._automation
+        models.UnitOfWork.flush_current()  # Branches load the automation from the db
+        branches = [self.get_branch() for _ in tasks]
+        workers = min(len(tasks), settings.SPLIT_WORKERS)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(self.run_branch, branch, task)
+                for branch, task in zip(branches, tasks)
+            ]
+        for future in futures:
+            future.result()  # Propagate exceptions
+        automation._db.refresh_from_db()  # Changes of the branches
+
+    def get_branch(self):
+        automation = self._automation
+        branch = automation.__class__(
+            automation=type(automation._db).objects.get(pk=automation._db.pk),
+            autorun=False,
+        )
+        branch._budget = automation._budget
+        branch._parallel_branch = True
+        return branch
+
+    @staticmethod
+    def run_branch(branch, task):
+        try:
+            branch.run(task.previous, getattr(branch, task.status))
+        finally:
+            connections.close_all()  # Only closes this thread's connections
+
 
 class Join(Node):
     """Collect tasks spawned by Split"""
@@ -410,31 +635,52 @@ class Join(Node):
     def execute(self, task: models.AutomationTaskModel):
         task = super().execute(task)
         if task:
-            split_task = self.get_split(task)
-            if split_task is None:
-                raise ImproperlyConfigured("Join() without Split()")
-            all_splits = []
-            for open_task in self._automation._db.automationtaskmodel_set.filter(
-                finished=None,
-            ):
-                split = self.get_split(open_task)
-                if split and split.id == split_task.id:
-                    all_splits.append(open_task)
-            assert len(all_splits) > 0, "Internal error: at least one split expected"
-            if (
-                len(all_splits) > 1
-            ):  # more than one split at the moment: close this split
-                self.leave(task)
-                self.store_result(task, "Open Join", [])  # Flag as open
-                return None
-            else:
-                all_path_ends = self._automation._db.automationtaskmodel_set.filter(
-                    message="Open Join", status=task.status  # Find open
-                )
-                self.store_result(
-                    task, "Joined", [tsk.id for tsk in all_path_ends] + [task.id]
+            if task.split_id is None:  # Split before branches recorded their split
+                return self.join_by_history(task)
+            if self._automation._parallel_branch:  # Write data before closing
+                self._automation._db.save()
+                models.UnitOfWork.flush_current()
+            with atomic():  # Flag this branch before other branches can see the count
+                remaining, split_id, split_depth = (
+                    models.AutomationTaskModel.close_branch(task.split_id)
                 )
-                all_path_ends.update(message="Joined")  # Join closed: clear flag
+                if remaining > 0:  # other branches still open: close this branch
+                    self.store_result(task, "Open Join", [])  # Flag as open
+                    self.leave(task)
+                    return None
+            if self._automation._parallel_branch:  # See the data of other branches
+                self._automation._db.merge_data()
+            all_path_ends = self._automation._db.automationtaskmodel_set.filter(
+                split_id=task.split_id, status=task.status, message="Open Join"
+            )
+            path_end_ids = list(all_path_ends.values_list("id", flat=True))
+            all_path_ends.update(message="Joined")  # Join closed: clear flag
+            # Continue in the branch of the split
+            task.split_id, task.split_depth = split_id, split_depth
+            self.store_result(task, "Joined", path_end_ids + [task.id])
+        return task
+
+    def join_by_history(self, task: models.AutomationTaskModel):
+        split_task = self.get_split(task)
+        if split_task is None:
+            raise ImproperlyConfigured("Join() without Split()")
+        all_splits = []
+        for open_task in self._automation._db.automationtaskmodel_set.filter(
+            finished=None,
+        ):
+            split = self.get_split(open_task)
+            if split and split.id == split_task.id:
+                all_splits.append(open_task)
+        assert len(all_splits) > 0, "Internal error: at least one split expected"
+        if len(all_splits) > 1:  # more than one split at the moment: close this split
+            self.store_result(task, "Open Join", [])  # Flag as open
+            self.leave(task)
+            return None
+        all_path_ends = self._automation._db.automationtaskmodel_set.filter(
+            message="Open Join", status=task.status  # Find open
+        )
+        self.store_result(task, "Joined", [tsk.id for tsk in all_path_ends] + [task.id])
+        all_path_ends.update(message="Joined")  # Join closed: clear flag
         return task
 
     def get_split(self, task):
@@ -466,8 +712,13 @@ class Execute(Node):
             raise ImproperlyConfigured(
                 f"Execute: expected callable, got {func.__class__.__name__}"
             )
+        if inspect.iscoroutinefunction(func):
+            func = async_to_sync(func)
         return func(task, *self.args[1:], **self.kwargs)
 
+    async def amethod(self, task, *args, **kwargs):
+        return await args[0](task, *self.args[1:], **self.kwargs)
+
     @on_execution_path
     def execute_handler(self, task: models.AutomationTaskModel):
         def func(task, *args, **kwargs):
@@ -479,7 +730,9 @@ class Execute(Node):
                 if isinstance(err, ImproperlyConfigured):
                     raise err
                 self._err = err
-                self.store_result(task, repr(err), get_error_report(*sys.exc_info()))
+                self.store_result(
+                    task, repr(err), get_error_report(*sys.exc_info()), artifact=True
+                )
 
         if self.args is not None and len(self.args) > 0:  # Empty arguments: No-op
             args = (self.resolve(value) for value in self.args)
@@ -494,19 +747,57 @@ class Execute(Node):
             else:
                 func(task, *args, **kwargs)
                 if self._err:
-                    if self._on_error:
-                        self._next = self._on_error
-                    else:
-                        self.release_lock(task)
-                        self._automation._db.finished = True
-                        self._automation._db.save()
-                        return None
+                    return self.fail(task)
+        return task
+
+    @on_execution_path
+    async def aexecute_handler(self, task: models.AutomationTaskModel):
+        """Awaits ``async def`` callables on the event loop. All other callables are
+        run by ``execute_handler`` through ``sync_to_async``."""
+        if (
+            self.args is None
+            or len(self.args) == 0
+            or not inspect.iscoroutinefunction(self.resolve(self.args[0]))
+            or self.kwargs.get("threaded", False)
+        ):
+            return await sync_to_async(self.execute_handler)(task)
+        args = (self.resolve(value) for value in self.args)
+        kwargs = {key: self.resolve(value) for key, value in self.kwargs.items()}
+        try:
+            result = await self.amethod(task, *args, **kwargs)
+        except Exception as err:
+            if isinstance(err, ImproperlyConfigured):
+                raise err
+            await sync_to_async(self.store_result)(
+                task, repr(err), get_error_report(*sys.exc_info()), artifact=True
+            )
+            return await sync_to_async(self.fail)(task)
+        await sync_to_async(self.store_result)(task, "OK", result)
         return task
 
+    def fail(self, task: models.AutomationTaskModel):
+        """Continues with the .OnError node if there is one, stops the automation
+        otherwise"""
+        if self._on_error:
+            self._jump = self._on_error
+            return task
+        self.release_lock(task)
+        self._automation._db.finished = True
+        self._automation._db.save()
+        return None
+
     def execute(self, task: models.AutomationTaskModel):
         task = super().execute(task)
         return self.execute_handler(task)
 
+    async def aexecute(self, task: models.AutomationTaskModel):
+        task = await sync_to_async(Node.execute)(self, task)
+        return await self.aexecute_handler(task)
+
+    def compile(self, automation_class):
+        super().compile(automation_class)
+        self._on_error = self.get_node_name(automation_class, self._on_error)
+
     def OnError(self, next_node):
         if self._on_error is not None:
             raise ImproperlyConfigured("Multiple .OnError statements")
@@ -534,11 +825,9 @@ class If(Execute):
         self._else = (clause_args, clause_kwargs)
         return self
 
-    @on_execution_path
-    def if_handler(self, task: models.AutomationTaskModel):
-        if self._then is None:
-            raise ImproperlyConfigured("Missing .Then statement")
-        this_path = self.eval(self._condition, task)
+    def choose_clause(self, task: models.AutomationTaskModel, this_path):
+        """Prepares the .Then or .Else clause. Returns True if it needs to be
+        executed"""
         task.message = str(bool(this_path))
         clause = self._then if this_path else self._else
         if clause is not None:
@@ -546,19 +835,45 @@ class If(Execute):
             if len(opt_args) == 1 and len(opt_kwargs) == 0:
                 resolved = self.resolve(opt_args[0])
                 if isinstance(resolved, Node) and not callable(resolved):
-                    self.Next(resolved)
-                    return task
+                    self._jump = resolved._name
+                    return False
             self.args = opt_args
             self.kwargs = opt_kwargs
+            return True
+        return False
+
+    @on_execution_path
+    def if_handler(self, task: models.AutomationTaskModel):
+        if self._then is None:
+            raise ImproperlyConfigured("Missing .Then statement")
+        condition = self.resolve(self._condition)
+        if self.choose_clause(task, self.eval(condition, task)):
             return self.execute_handler(task)
         return task
 
+    @on_execution_path
+    async def aif_handler(self, task: models.AutomationTaskModel):
+        if self._then is None:
+            raise ImproperlyConfigured("Missing .Then statement")
+        condition = self.resolve(self._condition)
+        if inspect.iscoroutinefunction(condition):
+            this_path = await condition(task)
+        else:
+            this_path = await sync_to_async(self.eval)(condition, task)
+        if await sync_to_async(self.choose_clause)(task, this_path):
+            return await self.aexecute_handler(task)
+        return task
+
     def execute(self, task: models.AutomationTaskModel):
         # Do not execute super() since If inherits from Execute and there
         # is nothing to execute, call Node.execute instead
         task = Node.execute(self, task)
         return self.if_handler(task)
 
+    async def aexecute(self, task: models.AutomationTaskModel):
+        task = await sync_to_async(Node.execute)(self, task)
+        return await self.aif_handler(task)
+
 
 class Form(Node):
     def __init__(
@@ -585,6 +900,14 @@ class Form(Node):
         self._form_kwargs = {}
         self._run = True
 
+    def ready(self, automation_instance, name=None):
+        super().ready(automation_instance, name)
+        # Attributes used by the views may refer to the automation
+        self._form = self.resolve(self._form)
+        self._context = self.resolve(self._context)
+        self._template_name = self.resolve(self._template_name)
+        self._success_url = self.resolve(self._success_url)
+
     def execute(self, task: models.AutomationTaskModel):
         task = super().execute(task)
 
@@ -714,7 +1037,7 @@ class SendMessage(Node):
 
     @on_execution_path
     def send_handler(self, task):
-        cls = self._target
+        cls = self.resolve(self._target)
         if isinstance(cls, str):
             cls = models.get_automation_class(cls)
         if issubclass(cls, Automation):
@@ -754,32 +1077,50 @@ def on_signal(signal, start=None, **kwargs):
 class Automation:
     model_class = models.AutomationModel
     unique = False
+    _budget = None  # Remaining steps and deadline of the current run
+    _iter = {None: None}  # Name of the node following a node (first for None)
+    _model_attributes = {}  # Model classes by attribute name
+    _open_tasks = {}  # Unfinished tasks by previous task id and node name
+    _fingerprinted = False  # No running instances without fingerprint left
+    _parallel_branch = False  # Runs a branch of a parallel Split
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.compile()
+        models.automation_classes[cls.get_automation_class_name()] = cls
 
-    def __init__(self, **kwargs):
-        super().__init__()
+    @classmethod
+    def compile(cls):
+        """Prepares the flow once per class: the order of the nodes and properties for
+        the model classes among the class attributes"""
+        cls._iter = {}
+        cls._model_attributes = {}
         prev = None
-        self._iter = {}
-        self._start = {}
-        for name, attr in self.__class__.__dict__.items():
-            if isinstance(attr, Node):  # Init nodes
-                self._iter[prev] = attr
-                attr.ready(self, name)
-                prev = attr
-            if isinstance(attr, type) and issubclass(
-                attr, Model
-            ):  # Attach to Model instance
-                at_c = copy(attr)  # Create copies of name and Model (attr)
-                nm_c = copy(name)
+        for name, attr in list(cls.__dict__.items()):
+            if isinstance(attr, Node):
+                cls._iter[prev] = name
+                prev = name
+            elif isinstance(attr, type) and issubclass(attr, Model):
+                cls._model_attributes[name] = attr
                 setattr(
-                    self.__class__,
+                    cls,
                     name,  # Replace property by get_model_instance
-                    property(lambda slf: slf.get_model_instance(at_c, nm_c), self),
+                    property(
+                        lambda slf, model=attr, name=name: slf.get_model_instance(
+                            model, name
+                        )
+                    ),
                 )
-                if name in kwargs and not isinstance(
-                    kwargs[name], int
-                ):  # Convert instance to id
-                    kwargs[name] = kwargs[name].id
-        self._iter[prev] = None  # Last item
+        cls._iter[prev] = None  # Last item
+        for name, attr in cls.__dict__.items():
+            if isinstance(attr, Node):
+                attr.compile(cls)
+
+    def __init__(self, **kwargs):
+        super().__init__()
+        for name in self._model_attributes:
+            if name in kwargs and not isinstance(kwargs[name], int):
+                kwargs[name] = kwargs[name].id  # Convert instance to id
         autorun = kwargs.pop("autorun", True)
         if "automation" in kwargs:
             if isinstance(kwargs.get("automation"), models.AutomationModel):
@@ -805,6 +1146,7 @@ class Automation:
         elif self.unique is True:  # Create or get singleton in DB
             self._db, created = self.model_class.objects.get_or_create(
                 automation_class=self.get_automation_class_name(),
+                defaults=self.get_model_defaults(),
             )
             if created:
                 self._db.data = kwargs
@@ -816,72 +1158,207 @@ class Automation:
                     "If 'automation' is given, no parameters allowed"
                 )
         elif self.unique:
-            assert isinstance(
-                self.unique, (list, tuple)
-            ), ".unique can be bool, list, tuple or None"
-            for key in self.unique:
-                assert key not in (
-                    "automation",
-                    "automation_id",
-                    "autorun",
-                ), f"'{key}' cannot be parameter to distinguish unique automations. Chose a different name."
-                assert key in kwargs, (
-                    "to ensure unique property, "
-                    "create automation with '%s=...' parameter" % key
-                )
-            qs = self.model_class.objects.filter(finished=False)
+            self.check_unique_keys(kwargs)
             self._create_model_properties(kwargs)
-            for instance in qs:
-                identical = sum(
-                    (
-                        (
-                            0
-                            if key not in instance.data
-                            or instance.data[key] != kwargs[key]
-                            else 1
-                        )
-                        for key in self.unique
-                    )
-                )
-                if identical == len(self.unique):
-                    self._db = instance
-                    break
-            else:
-                self._db = self.model_class.objects.create(
-                    automation_class=self.get_automation_class_name(),
+            fingerprint = self.get_fingerprint(kwargs)
+            self._db = self.model_class.objects.filter(
+                fingerprint=fingerprint, finished=False
+            ).first() or self.get_unfingerprinted(kwargs, fingerprint)
+            if self._db is None:  # Duplicates are prevented by a unique constraint
+                self._db = self.model_class.objects.get_or_create(
+                    fingerprint=fingerprint,
                     finished=False,
-                    data=kwargs,
-                )
+                    defaults=dict(
+                        automation_class=self.get_automation_class_name(),
+                        data=kwargs,
+                        **self.get_model_defaults(),
+                    ),
+                )[0]
         else:
             self._create_model_properties(kwargs)
             self._db = self.model_class.objects.create(
                 automation_class=self.get_automation_class_name(),
                 finished=False,
                 data=kwargs,
+                **self.get_model_defaults(),
             )
         assert self._db is not None, "Internal error"
         if autorun and not self.finished():
             self.run()
 
-    def _create_model_properties(self, kwargs):
+    @classmethod
+    def check_unique_keys(cls, kwargs):
+        assert isinstance(
+            cls.unique, (list, tuple)
+        ), ".unique can be bool, list, tuple or None"
+        for key in cls.unique:
+            assert key not in (
+                "automation",
+                "automation_id",
+                "autorun",
+            ), f"'{key}' cannot be parameter to distinguish unique automations. Chose a different name."
+            assert key in kwargs, (
+                "to ensure unique property, "
+                "create automation with '%s=...' parameter" % key
+            )
+
+    @classmethod
+    def _create_model_properties(cls, kwargs):
         for name, value in kwargs.items():
             if isinstance(value, Model):
                 model_class = value.__class__
                 cname = copy(name)  # name might reference something else later
                 setattr(
-                    self.__class__,
+                    cls,
                     name,  # Replace property by get_model_instance
                     property(lambda slf: slf.get_model_instance(model_class, cname)),
                 )
                 kwargs[name] = kwargs[name].id
 
+    @classmethod
+    def get_fingerprint(cls, data):
+        """Hash of the automation class and the values of the keys given by ``unique``"""
+        values = [cls.get_automation_class_name()] + [data[key] for key in cls.unique]
+        return hashlib.sha1(
+            json.dumps(values, sort_keys=True, default=str).encode("utf-8")
+        ).hexdigest()
+
+    @classmethod
+    def get_unfingerprinted(cls, data, fingerprint):
+        """Finds a running instance with identical unique keys that was created before
+        fingerprints were stored. The first call stores the fingerprints of all such
+        instances (see ``backfill_fingerprints``), later calls return ``None``."""
+        if cls._fingerprinted:
+            return None
+        return cls.backfill_fingerprints().get(fingerprint)
+
+    @classmethod
+    def backfill_fingerprints(cls, batch_size=500):
+        """Stores the fingerprints of running instances created before fingerprints
+        were stored and returns them by fingerprint. Instances missing unique keys
+        and duplicates of an instance keep an empty fingerprint."""
+        fingerprinted = {}
+        instances = cls.model_class.objects.filter(
+            automation_class=cls.get_automation_class_name(),
+            finished=False,
+            fingerprint="",
+        ).order_by("id")
+        for instance in instances.iterator(chunk_size=batch_size):
+            if all(key in instance.data for key in cls.unique):
+                instance.fingerprint = cls.get_fingerprint(instance.data)
+                fingerprinted.setdefault(instance.fingerprint, instance)
+        new = list(fingerprinted.values())
+        try:
+            with atomic():
+                cls.model_class.objects.bulk_update(
+                    new, ["fingerprint"], batch_size=batch_size
+                )
+        except IntegrityError:  # Fingerprint stored concurrently: one at a time
+            for instance in new:
+                try:
+                    with atomic():
+                        instance.save(update_fields=["fingerprint"])
+                except IntegrityError:
+                    del fingerprinted[instance.fingerprint]
+        cls._fingerprinted = True  # New instances always get a fingerprint
+        return fingerprinted
+
+    @classmethod
+    def bulk_start(cls, items, run=False, batch_size=500, due=None):
+        """Creates an automation instance for each item of ``items`` using a fixed
+        number of queries per batch and returns the number of instances created. Items
+        are dicts of parameters, instances of a model class attribute, or a queryset of
+        such instances. Instances are started by workers once ``due`` (default: now)
+        or, if ``run`` is true, run right away."""
+        assert cls.unique is not True, "A singleton automation cannot be bulk started"
+        if isinstance(items, QuerySet):  # Only fetch the primary keys
+            name = cls.get_model_attribute(items.model)
+            items = ({name: pk} for pk in items.values_list("pk", flat=True).iterator())
+        items = iter(items)
+        started = 0
+        while True:
+            batch = list(itertools.islice(items, batch_size))
+            if not batch:
+                return started
+            instances = cls.bulk_create(batch, due)
+            if run:
+                for instance in instances:
+                    cls(automation=instance, autorun=False).run()
+            started += len(instances)
+
+    @classmethod
+    def bulk_create(cls, batch, due=None):
+        """Creates the automation model instances for a batch of ``bulk_start``"""
+        instances = {}
+        for kwargs in batch:
+            if isinstance(kwargs, Model):
+                kwargs = {cls.get_model_attribute(kwargs.__class__): kwargs.pk}
+            kwargs = dict(kwargs)
+            for name in cls._model_attributes:
+                if name in kwargs and not isinstance(kwargs[name], int):
+                    kwargs[name] = kwargs[name].id  # Convert instance to id
+            if cls.unique:
+                cls.check_unique_keys(kwargs)
+            cls._create_model_properties(kwargs)
+            instance = cls.model_class(
+                automation_class=cls.get_automation_class_name(),
+                finished=False,
+                data=kwargs,
+                paused_until=due,
+                **cls.get_model_defaults(),
+            )
+            if cls.unique:
+                instance.fingerprint = cls.get_fingerprint(kwargs)
+                if cls.get_unfingerprinted(kwargs, instance.fingerprint):
+                    continue
+            # Drop duplicates within the batch
+            instances.setdefault(instance.fingerprint or len(instances), instance)
+
+        def skip_running():
+            """Drops the instances already running, returns ``True`` if any"""
+            running = list(
+                cls.model_class.objects.filter(
+                    fingerprint__in=list(instances), finished=False
+                ).values_list("fingerprint", flat=True)
+            )
+            for fingerprint in running:
+                instances.pop(fingerprint, None)
+            return bool(running)
+
+        if cls.unique:
+            skip_running()
+        while instances:
+            try:
+                with atomic():
+                    return cls.model_class.create_all(list(instances.values()))
+            except IntegrityError:  # Started concurrently: skip them and try again
+                if not (cls.unique and skip_running()):
+                    raise
+        return []
+
+    @classmethod
+    def get_model_attribute(cls, model):
+        """Returns the name of the class attribute declaring the model class ``model``"""
+        names = [
+            name
+            for name, model_class in cls._model_attributes.items()
+            if issubclass(model, model_class)
+        ]
+        if len(names) != 1:
+            raise ImproperlyConfigured(
+                f"{cls.__name__} needs exactly one attribute for model "
+                f"{model.__name__}, found {len(names)}"
+            )
+        return names[0]
+
     def get_model_instance(self, model, name):
         if not hasattr(self, "_" + name):
             setattr(self, "_" + name, model.objects.get(id=self._db.data[name]))
         return getattr(self, "_" + name)
 
-    def get_automation_class_name(self):
-        return self.__module__ + "." + self.__class__.__name__
+    @classmethod
+    def get_automation_class_name(cls):
+        return cls.__module__ + "." + cls.__name__
 
     @property
     def id(self):
@@ -899,19 +1376,29 @@ class Automation:
         """Run automation steps in a background thread to, e.g., do not block
         the request response cycle"""
         threading.Thread(
-            target=self.run, kwargs=dict(task=task, next_task=next_task)
+            target=self.run, kwargs=dict(task=task, next_node=next_task)
         ).start()
 
     def run(self, task=None, next_node=None):
-        """Execute automation until external responses are necessary"""
+        """Execute automation until external responses are necessary or the
+        automation's step or time budget is used up"""
         assert not self.finished(), ValueError(
             "Trying to run an already finished or killed automation"
         )
 
+        if self._budget is None:  # Outermost call: start budget
+            self._budget = self.get_budget()
+            try:
+                return self.run(task, next_node)
+            finally:
+                self._budget = None
+
         if next_node is None:
-            last_tasks = self._db.automationtaskmodel_set.filter(finished=None)
+            last_tasks = self.get_open_tasks()
             if len(last_tasks) == 0:  # Start
-                last, next_node = None, self._iter[None]  # First
+                if self._iter[None] is None:  # No nodes of its own: nothing to run
+                    return None
+                last, next_node = None, getattr(self, self._iter[None])  # First
             else:
                 for last_task in last_tasks:
                     node = getattr(self, last_task.status)
@@ -919,11 +1406,138 @@ class Automation:
                 return
 
         while next_node is not None:
-            task = next_node.enter(task)
-            task = next_node.execute(task)
-            last, next_node = task, next_node.leave(task)
+            with models.UnitOfWork():  # Write each row once per step
+                task = next_node.enter(task)
+                if task is not None and self.budget_exhausted():
+                    # Keep task open: the next run continues here
+                    return next_node.release_lock(task)
+                task = next_node.process(task)
+                if task is not None and not next_node.renew_lock(task):
+                    return None
+                last, next_node = task, next_node.leave(task)
+            self._budget[0] += 1
         return last
 
+    def get_open_tasks(self):
+        """Fetches the unfinished tasks together with their previous tasks in one query.
+        All of them share this automation's model instance. Each task is kept until
+        its node is entered, so that entering it does not fetch it again."""
+        tasks = list(
+            self._db.automationtaskmodel_set.filter(finished=None).select_related(
+                "previous"
+            )
+        )
+        for task in tasks:  # task.automation is set by the related manager
+            if task.previous is not None:
+                task.previous.automation = self._db
+        self._open_tasks = {(task.previous_id, task.status): task for task in tasks}
+        return tasks
+
+    def pop_open_task(self, prev_task, name):
+        """Returns the task fetched by ``get_open_tasks`` that follows ``prev_task`` at
+        the node ``name``, if any"""
+        return self._open_tasks.pop((getattr(prev_task, "id", None), name), None)
+
+    async def arun(self, task=None, next_node=None):
+        """Asynchronous version of ``run``: ``async def`` callables of ``Execute`` and
+        ``If`` nodes are awaited on the event loop, all database access is done through
+        ``sync_to_async``"""
+        assert not self.finished(), ValueError(
+            "Trying to run an already finished or killed automation"
+        )
+
+        if self._budget is None:  # Outermost call: start budget
+            self._budget = self.get_budget()
+            try:
+                return await self.arun(task, next_node)
+            finally:
+                self._budget = None
+
+        if next_node is None:
+            last_tasks = await sync_to_async(self.get_open_tasks)()
+            if len(last_tasks) == 0:  # Start
+                if self._iter[None] is None:  # No nodes of its own: nothing to run
+                    return None
+                last, next_node = None, getattr(self, self._iter[None])  # First
+            else:
+                for last_task in last_tasks:
+                    node = getattr(self, last_task.status)
+                    await self.arun(last_task.previous, node)
+                return
+
+        while next_node is not None:
+            async with models.UnitOfWork():  # Write each row once per step
+                task = await sync_to_async(next_node.enter)(task)
+                if task is not None and self.budget_exhausted():
+                    # Keep task open: the next run continues here
+                    return await sync_to_async(next_node.release_lock)(task)
+                task = await next_node.aprocess(task)
+                if (
+                    task is not None
+                    and task.lease_expiring()
+                    and not await sync_to_async(next_node.renew_lock)(task)
+                ):
+                    return None
+                last, next_node = task, await sync_to_async(next_node.leave)(task)
+            self._budget[0] += 1
+        return last
+
+    @classmethod
+    def get_budget(cls):
+        """Returns a list of the steps done, the maximum steps, and the deadline
+        for a run"""
+        meta = getattr(cls, "Meta", None)
+        steps = getattr(meta, "step_budget", settings.STEP_BUDGET)
+        seconds = getattr(meta, "time_budget", settings.TIME_BUDGET)
+        return [
+            0,
+            steps,
+            None if seconds is None else time.monotonic() + seconds,
+        ]
+
+    def budget_exhausted(self):
+        """Each run makes at least one step, even if the budget is used up"""
+        done, steps, deadline = self._budget
+        return done > 0 and (
+            (steps is not None and done >= steps)
+            or (deadline is not None and time.monotonic() > deadline)
+        )
+
+    @classmethod
+    def get_model_defaults(cls):
+        """Returns the class-specific fields of a new automation model instance"""
+        return dict(priority=cls.get_priority(), queue=cls.get_queue())
+
+    @classmethod
+    def get_retention_days(cls, default=30):
+        """Returns the number of days the history of finished instances is kept, or
+        ``None`` to keep it"""
+        if hasattr(cls, "Meta"):
+            if hasattr(cls.Meta, "retention_days"):
+                return cls.Meta.retention_days
+        return default
+
+    @classmethod
+    def get_queue(cls):
+        """Returns the name of the queue the automation's instances are run from"""
+        if hasattr(cls, "Meta"):
+            if hasattr(cls.Meta, "queue"):
+                return cls.Meta.queue
+        return "default"
+
+    @classmethod
+    def get_priority(cls):
+        """Returns the default priority of the automation's instances"""
+        if hasattr(cls, "Meta"):
+            if hasattr(cls.Meta, "priority"):
+                return cls.Meta.priority
+        return 0
+
+    def set_priority(self, priority):
+        """Changes the priority of this automation instance"""
+        self._db.priority = priority
+        self._db.save()
+
     @classmethod
     def get_verbose_name(cls):
         if hasattr(cls, "Meta"):
@@ -1054,32 +1668,23 @@ class Automation:
 
 
 def get_automations(app=None):
-    def check_module(mod):
-        for item in dir(mod):
-            attr = getattr(mod, item)
-            if isinstance(attr, type) and issubclass(attr, Automation):
-                automation_list.append(
-                    (attr.__module__ + "." + attr.__name__, attr.get_verbose_name())
-                )
-
-    automation_list = []
+    """Returns the dotted names and verbose names of the automations defined in
+    modules named ``automations`` or, if given, in the module ``app`` or its
+    submodule ``automations``"""
     if app is None:
-        for name, mod in sys.modules.items():
-            if name.rsplit(".")[-1] == "automations":
-                check_module(mod)
+        modules = None
     else:
-        apps = app.split(".")
-
-        mod = __import__(apps[0])
-        for next in apps[1:]:
-            mod = getattr(mod, next)
-
-        check_module(mod)
-        if hasattr(mod, "automations"):
-            mod = getattr(mod, "automations")
-            check_module(mod)
-
-    return automation_list
+        import_module(app)
+        modules = (app, app + ".automations")
+    return [
+        (name, cls.get_verbose_name())
+        for name, cls in models.automation_classes.items()
+        if (
+            cls.__module__.rsplit(".", 1)[-1] == "automations"
+            if modules is None
+            else cls.__module__ in modules
+        )
+    ]
 
 
 def require_data_parameters(**kwargs):
@@ -0,0 +1,76 @@
+import gzip
+import json
+import tempfile
+from logging import getLogger
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.timezone import now
+
+from automations.models import AutomationModel
+
+logger = getLogger(__name__)
+
+
+def open_archive(fileobj, name, mode):
+    """Returns a binary stream (de)compressing ``fileobj``: with zstd if ``name`` ends
+    with ``.zst`` (requires the ``zstandard`` package), with gzip otherwise"""
+    if name.endswith(".zst"):
+        try:
+            import zstandard
+        except ImportError:
+            raise CommandError("zstd compressed archives require the zstandard package")
+        if mode == "wb":
+            return zstandard.ZstdCompressor().stream_writer(fileobj, closefd=False)
+        return zstandard.ZstdDecompressor().stream_reader(fileobj, closefd=False)
+    return gzip.GzipFile(fileobj=fileobj, mode=mode)
+
+
+class Command(BaseCommand):
+    help = (
+        "Archive Automations older than the specified number of days (default=30) "
+        "or the retention period of their class, including their tasks, to a "
+        "compressed JSONL file"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "days_old",
+            type=int,
+            nargs="?",
+            help="The minumum age of an Automation (in days) before it is archived",
+            default=30,
+        )
+        parser.add_argument(
+            "--output",
+            default=None,
+            help="Name of the archive in the default storage (gzip compressed unless "
+            "it ends with .zst)",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Number of automations read from the database at a time",
+        )
+
+    def handle(self, *args, **kwargs):
+        name = kwargs["output"] or f"automations/archive-{now():%Y%m%d-%H%M%S}.jsonl.gz"
+        count = 0
+        with tempfile.TemporaryFile() as archive:
+            with open_archive(archive, name, "wb") as stream:
+                for record in AutomationModel.iter_archive(
+                    AutomationModel.get_expired(kwargs["days_old"]),
+                    kwargs["batch_size"],
+                ):
+                    stream.write(
+                        json.dumps(record, cls=DjangoJSONEncoder).encode("utf-8")
+                    )
+                    stream.write(b"\n")
+                    count += 1
+            archive.seek(0)
+            name = default_storage.save(name, File(archive))
+
+        self.stdout.write(f"{count} AutomationModel instances archived to {name}")
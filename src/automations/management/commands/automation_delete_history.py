@@ -2,13 +2,17 @@ from logging import getLogger
 
 from django.core.management.base import BaseCommand
 
+from automations import settings
 from automations.models import AutomationModel
 
 logger = getLogger(__name__)
 
 
 class Command(BaseCommand):
-    help = "Delete Automations older than the specified number of days (default=30)"
+    help = (
+        "Delete Automations older than the specified number of days (default=30) "
+        "or the retention period of their class"
+    )
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -18,15 +22,38 @@ class Command(BaseCommand):
             help="The minumum age of an Automation (in days) before it is deleted",
             default=30,
         )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.DELETE_BATCH_SIZE,
+            help="Maximum number of objects deleted by a single query",
+        )
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=0,
+            help="Seconds to pause after each batch to let workers proceed",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only count the objects that would be deleted",
+        )
 
     def handle(self, *args, **kwargs):
         days_old = kwargs["days_old"]
-        total, info_dict = AutomationModel.delete_history(days_old)
+        total, info_dict = AutomationModel.delete_history(
+            days_old,
+            batch_size=kwargs["batch_size"],
+            sleep=kwargs["sleep"],
+            dry_run=kwargs["dry_run"],
+        )
 
         automation_count = info_dict.get("automations.AutomationModel", 0)
         task_count = info_dict.get("automations.AutomationTaskModel", 0)
 
         self.stdout.write(
-            f"{total} total objects deleted, including {automation_count} AutomationModel "
-            f"instances, and {task_count} AutomationTaskModel instances"
+            f"{total} total objects {'to be ' if kwargs['dry_run'] else ''}deleted, "
+            f"including {automation_count} AutomationModel instances, and "
+            f"{task_count} AutomationTaskModel instances"
         )
@@ -0,0 +1,34 @@
+import io
+import json
+from logging import getLogger
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from automations.models import AutomationModel
+
+from .automation_archive import open_archive
+
+logger = getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Restore Automations and their tasks from an archive"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "archive",
+            help="Name of the archive in the default storage",
+        )
+
+    def handle(self, *args, **kwargs):
+        name = kwargs["archive"]
+        with default_storage.open(name, "rb") as archive:
+            with io.TextIOWrapper(
+                open_archive(archive, name, "rb"), encoding="utf-8"
+            ) as lines:
+                count = AutomationModel.restore_archive(
+                    json.loads(line) for line in lines
+                )
+
+        self.stdout.write(f"{count} AutomationModel instances restored from {name}")
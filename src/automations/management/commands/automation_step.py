@@ -1,6 +1,7 @@
 from logging import getLogger
 
-from django.core.management import BaseCommand
+from asgiref.sync import async_to_sync
+from django.core.management import BaseCommand, CommandError
 
 from automations.models import AutomationModel
 
@@ -10,5 +11,66 @@ logger = getLogger(__name__)
 class Command(BaseCommand):
     help = "Touch every automation to proceed."
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Number of worker threads running due automations (default=1)",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=None,
+            help="Run due automations on an asyncio event loop, interleaving up to "
+            "this many automations (replaces --workers)",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=None,
+            help="Number of automations a worker claims at a time",
+        )
+        parser.add_argument(
+            "--queue",
+            action="append",
+            dest="queues",
+            help="Only run automations from this queue (can be repeated)",
+        )
+        parser.add_argument(
+            "--shard",
+            type=self.parse_shard,
+            default=None,
+            help="Only run the i-th of n shards of automations, given as i/n",
+        )
+
+    @staticmethod
+    def parse_shard(value):
+        try:
+            index, count = (int(part) for part in value.split("/"))
+        except ValueError:
+            raise CommandError(f"Shard needs to be of the form i/n, got '{value}'")
+        if not 0 <= index < count:
+            raise CommandError(f"Shard {value}: i needs to be between 0 and n-1")
+        return index, count
+
+    def get_run_kwargs(self, options):
+        return dict(
+            workers=options["workers"],
+            batch_size=options["batch_size"],
+            queues=options["queues"],
+            shard=options["shard"],
+        )
+
+    def run_due(self, options):
+        kwargs = self.get_run_kwargs(options)
+        if options["concurrency"] is None:
+            AutomationModel.run(**kwargs)
+        else:
+            del kwargs["workers"]
+            async_to_sync(AutomationModel.arun)(
+                concurrency=options["concurrency"], **kwargs
+            )
+
     def handle(self, *args, **options):
-        AutomationModel.run()
+        self.run_due(options)
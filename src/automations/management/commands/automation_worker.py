@@ -0,0 +1,149 @@
+import signal
+import threading
+import time
+from logging import getLogger
+
+from django.utils.timezone import now
+
+from automations import metrics, settings
+from automations.models import AutomationModel
+
+from .automation_step import Command as StepCommand
+
+logger = getLogger(__name__)
+
+
+class Command(StepCommand):
+    help = (
+        "Keep running automations. Sleeps until the next automation is due or "
+        "until new activity is detected."
+    )
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            "--max-lifetime",
+            type=float,
+            default=settings.WORKER_MAX_LIFETIME,
+            help="Exit after this many seconds, e.g., to be restarted by a supervisor",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=settings.WORKER_POLL_INTERVAL,
+            help="Maximum time in seconds between two runs",
+        )
+        parser.add_argument(
+            "--nudge-interval",
+            type=float,
+            default=settings.WORKER_NUDGE_INTERVAL,
+            help="Time in seconds between checks for new or updated automations",
+        )
+        parser.add_argument(
+            "--metrics-port",
+            type=int,
+            default=None,
+            help="Serve the worker's metrics in the Prometheus text format on this port",
+        )
+        parser.add_argument(
+            "--metrics-address",
+            default="127.0.0.1",
+            help="Address to serve the metrics on, default is localhost only",
+        )
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stop_event = threading.Event()
+        self.wakeup = threading.Event()
+
+    @property
+    def stopping(self):
+        return self.stop_event.is_set()
+
+    def get_run_kwargs(self, options):
+        return dict(super().get_run_kwargs(options), stop=self.stop_event)
+
+    def handle(self, *args, **options):
+        deadline = (
+            None
+            if options["max_lifetime"] is None
+            else time.monotonic() + options["max_lifetime"]
+        )
+        server = None
+        if options["metrics_port"] is not None:
+            metrics.metrics.connect()
+            server = metrics.serve(options["metrics_port"], options["metrics_address"])
+        previous_handlers = {
+            signum: signal.signal(signum, handler)
+            for signum, handler in (
+                (signal.SIGTERM, self.stop),
+                (signal.SIGINT, self.stop),
+                (signal.SIGUSR1, self.nudge),
+            )
+        }
+        try:
+            while not self.stopping:
+                self.wakeup.clear()
+                self.run_due(options)
+                last_run = now()
+                if deadline is not None and time.monotonic() >= deadline:
+                    logger.info("Automation worker reached its maximum lifetime")
+                    break
+                self.sleep(
+                    last_run,
+                    deadline,
+                    options["poll_interval"],
+                    options["nudge_interval"],
+                    options["queues"],
+                    options["shard"],
+                )
+        finally:
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
+            if server is not None:
+                server.shutdown()
+
+    def stop(self, signum, frame):
+        """Finish the running automations, release the other claims, then exit"""
+        logger.info("Automation worker stopping")
+        self.stop_event.set()
+        self.wakeup.set()
+
+    def nudge(self, signum, frame):
+        """Wake up and run due automations immediately"""
+        self.wakeup.set()
+
+    def get_timeout(self, last_run, deadline, poll_interval, queues=None, shard=None):
+        timeout = poll_interval
+        next_wakeup = AutomationModel.get_next_wakeup(last_run, queues, shard)
+        if next_wakeup is not None:
+            timeout = min(timeout, (next_wakeup - now()).total_seconds())
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.monotonic())
+        return max(timeout, 0)
+
+    def sleep(
+        self,
+        last_run,
+        deadline,
+        poll_interval,
+        nudge_interval,
+        queues=None,
+        shard=None,
+    ):
+        """Sleep until the next automation is due, new automations or messages have
+        been saved to the database, or the worker is nudged or stopped."""
+        end = time.monotonic() + self.get_timeout(
+            last_run, deadline, poll_interval, queues, shard
+        )
+        updated = AutomationModel.select(
+            AutomationModel.objects.all(), queues, shard
+        ).filter(updated__gt=last_run)
+        while not self.stopping:
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                return
+            if self.wakeup.wait(min(remaining, nudge_interval)):
+                return
+            if updated.exists():
+                return
@@ -0,0 +1,109 @@
+# coding=utf-8
+import threading
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from . import signals
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics:
+    """Collects counts and durations of node steps and runs from the instrumentation
+    signals and renders them in the Prometheus text format"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.steps = defaultdict(lambda: [0, 0.0])  # labels -> [count, seconds]
+        self.runs = [0, 0.0]
+
+    def connect(self):
+        signals.node_step.connect(
+            self.record_step, weak=False, dispatch_uid="automations.metrics.step"
+        )
+        signals.automations_run.connect(
+            self.record_run, weak=False, dispatch_uid="automations.metrics.run"
+        )
+
+    def disconnect(self):
+        signals.node_step.disconnect(dispatch_uid="automations.metrics.step")
+        signals.automations_run.disconnect(dispatch_uid="automations.metrics.run")
+
+    def reset(self):
+        with self.lock:
+            self.steps.clear()
+            self.runs = [0, 0.0]
+
+    def record_step(self, sender, node, phase, duration, outcome, **kwargs):
+        labels = (f"{sender.__module__}.{sender.__name__}", node, phase, outcome)
+        with self.lock:
+            entry = self.steps[labels]
+            entry[0] += 1
+            entry[1] += duration
+
+    def record_run(self, sender, duration, **kwargs):
+        with self.lock:
+            self.runs[0] += 1
+            self.runs[1] += duration
+
+    def render(self):
+        with self.lock:
+            steps = sorted(
+                (labels, list(entry)) for labels, entry in self.steps.items()
+            )
+            runs = list(self.runs)
+        lines = []
+        for index, (name, description) in enumerate(
+            (
+                ("automations_node_steps_total", "Number of node steps"),
+                ("automations_node_step_seconds_total", "Time spent in node steps"),
+            )
+        ):
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} counter")
+            for (automation, node, phase, outcome), entry in steps:
+                lines.append(
+                    f'{name}{{automation="{escape(automation)}",node="{escape(node)}",'
+                    f'phase="{phase}",outcome="{outcome}"}} {entry[index]}'
+                )
+        for index, (name, description) in enumerate(
+            (
+                ("automations_runs_total", "Number of runs over all due automations"),
+                ("automations_run_seconds_total", "Time spent in runs"),
+            )
+        ):
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name} {runs[index]}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+"""Global collector, connected at startup if ``settings.ATM_METRICS`` is set"""
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Do not log every scrape
+
+
+def serve(port, address="127.0.0.1"):
+    """Serves the metrics of this process over http in a background thread, e.g., for
+    worker processes which do not run the web application. Only local clients can
+    connect unless another ``address`` is given. Returns the server; call
+    its ``shutdown()`` method to stop it."""
+    server = ThreadingHTTPServer((address, port), MetricsRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
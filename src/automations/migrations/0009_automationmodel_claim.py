@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("automations", "0008_auto_20220123_2236"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="automationmodel",
+            name="claimed_by",
+            field=models.CharField(
+                blank=True, default="", max_length=64, verbose_name="Claimed by"
+            ),
+        ),
+        migrations.AddField(
+            model_name="automationmodel",
+            name="claimed_until",
+            field=models.DateTimeField(null=True, verbose_name="Claimed until"),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("automations", "0009_automationmodel_claim"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="automationmodel",
+            name="updated",
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AddIndex(
+            model_name="automationmodel",
+            index=models.Index(
+                fields=["finished", "paused_until"],
+                name="automations_finishe_2e9865_idx",
+            ),
+        ),
+    ]
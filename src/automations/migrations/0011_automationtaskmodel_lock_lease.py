@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:55
+
+from django.db import migrations, models
+from django.utils.timezone import now
+
+
+def start_lease(apps, schema_editor):
+    """Let tasks locked before the migration become stale after the lease"""
+    AutomationTaskModel = apps.get_model("automations", "AutomationTaskModel")
+    AutomationTaskModel.objects.filter(locked__gt=0).update(locked_at=now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("automations", "0010_automationmodel_wakeup_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="automationtaskmodel",
+            name="locked_at",
+            field=models.DateTimeField(
+                db_index=True, null=True, verbose_name="Locked at"
+            ),
+        ),
+        migrations.AddField(
+            model_name="automationtaskmodel",
+            name="locked_by",
+            field=models.CharField(
+                blank=True, default="", max_length=64, verbose_name="Locked by"
+            ),
+        ),
+        migrations.RunPython(start_lease, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("automations", "0011_automationtaskmodel_lock_lease"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="automationmodel",
+            name="priority",
+            field=models.IntegerField(default=0, verbose_name="Priority"),
+        ),
+        migrations.AddIndex(
+            model_name="automationmodel",
+            index=models.Index(
+                fields=["finished", "priority", "automation_class"],
+                name="automations_finishe_ab5464_idx",
+            ),
+        ),
+    ]
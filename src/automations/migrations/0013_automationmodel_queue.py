@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("automations", "0012_automationmodel_priority"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="automationmodel",
+            name="queue",
+            field=models.CharField(
+                db_index=True, default="default", max_length=64, verbose_name="Queue"
+            ),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("automations", "0013_automationmodel_queue"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="automationtaskmodel",
+            name="open_branches",
+            field=models.IntegerField(
+                default=0,
+                help_text="Branches of a Split task that have not been joined yet",
+                verbose_name="Open branches",
+            ),
+        ),
+        migrations.AddField(
+            model_name="automationtaskmodel",
+            name="split",
+            field=models.ForeignKey(
+                blank=True,
+                help_text="Task of the innermost Split node this task is a branch of",
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="branch_tasks",
+                to="automations.automationtaskmodel",
+                verbose_name="Split task",
+            ),
+        ),
+        migrations.AddField(
+            model_name="automationtaskmodel",
+            name="split_depth",
+            field=models.IntegerField(
+                default=0,
+                help_text="Number of Split nodes this task is a branch of",
+                verbose_name="Split depth",
+            ),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("automations", "0014_automationtaskmodel_split"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="automationmodel",
+            name="fingerprint",
+            field=models.CharField(
+                blank=True,
+                db_index=True,
+                default="",
+                help_text="Hash of the automation class and the values of its unique keys",
+                max_length=64,
+                verbose_name="Uniqueness fingerprint",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="automationmodel",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(
+                    ("finished", False), models.Q(("fingerprint", ""), _negated=True)
+                ),
+                fields=("fingerprint",),
+                name="automations_unique_fingerprint",
+            ),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("automations", "0015_automationmodel_fingerprint"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AutomationArtifactModel",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "digest",
+                    models.CharField(
+                        max_length=64, unique=True, verbose_name="SHA-256 digest"
+                    ),
+                ),
+                ("content", models.BinaryField(verbose_name="Compressed content")),
+                (
+                    "size",
+                    models.IntegerField(
+                        help_text="Size of the uncompressed content in bytes",
+                        verbose_name="Size",
+                    ),
+                ),
+                ("created", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="automationtaskmodel",
+            name="artifact",
+            field=models.ForeignKey(
+                blank=True,
+                help_text="Large results and error reports are stored here",
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                to="automations.automationartifactmodel",
+                verbose_name="Result artifact",
+            ),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:49
+
+from django.db import migrations
+
+import automations.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("automations", "0016_automationartifactmodel"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="automationmodel",
+            name="data",
+            field=automations.models.PatchableJSONField(
+                default=dict, verbose_name="Data"
+            ),
+        ),
+    ]
@@ -1,19 +1,43 @@
 # coding=utf-8
+import asyncio
+import collections
+import contextvars
 import datetime
 import hashlib
+import json
+import os
+import socket
 import sys
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from logging import getLogger
 from types import MethodType
 
+from asgiref.sync import sync_to_async
 from django.conf import settings as project_settings
 from django.contrib.auth import get_user_model
-from django.db import models
-from django.db.models import Q
-from django.utils.module_loading import import_string
+from django.core import serializers
+from django.db import IntegrityError, connection, connections, models, transaction
+from django.db.models import (
+    Case,
+    Exists,
+    F,
+    Func,
+    Max,
+    Min,
+    OuterRef,
+    ProtectedError,
+    Q,
+    Value,
+    When,
+)
+from django.db.models.functions import Cast, Mod
 from django.utils.timezone import now
 from django.utils.translation import gettext as _
 
-from . import settings
+from . import settings, signals
 
 # Create your models here.
 
@@ -23,13 +47,184 @@ User = get_user_model()
 Group = settings.get_group_model()
 
 
+automation_classes = {}
+"""Registry of the automation classes by their dotted name. Classes register when they
+are defined, the ``automations`` modules of all installed apps are imported at
+startup."""
+
+
 def get_automation_class(dotted_name):
-    components = dotted_name.rsplit(".", 1)
+    if dotted_name in automation_classes:
+        return automation_classes[dotted_name]
+    components = dotted_name.rsplit(".", 1)  # Not imported yet
     cls = __import__(components[0], fromlist=[components[-1]])
     cls = getattr(cls, components[-1])
     return cls
 
 
+def get_update_fields(instance, exclude):
+    """Returns the names of all concrete fields of ``instance`` except ``exclude``"""
+    return [
+        field.name
+        for field in instance._meta.concrete_fields
+        if not field.primary_key and field.name not in exclude
+    ]
+
+
+def delete_in_batches(queryset, batch_size, sleep=0):
+    """Deletes the objects of ``queryset`` in batches of at most ``batch_size`` objects,
+    each in its own query, sleeping ``sleep`` seconds after each batch. Returns the
+    number of deleted objects per model label as ``queryset.delete()`` does."""
+    counts = collections.Counter()
+    while True:
+        pks = list(queryset.order_by().values_list("pk", flat=True)[:batch_size])
+        if not pks:
+            return counts
+        counts.update(queryset.model.objects.filter(pk__in=pks).delete()[1])
+        if sleep:
+            time.sleep(sleep)
+
+
+class UnitOfWork:
+    """Collects the saves of existing task and automation rows during a step of the
+    execution loop and writes each row once at its end. Saves are written right
+    away outside a unit of work, in other threads, or if ``ATM_STRICT_WRITES`` is
+    set."""
+
+    current = contextvars.ContextVar("automations_unit_of_work", default=None)
+
+    def __init__(self):
+        self.pending = {}  # Instance and fields to save by id of the instance
+        self.token = None
+
+    def __enter__(self):
+        if not settings.STRICT_WRITES:
+            self.token = self.current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.reset()
+        if exc_type is None:
+            self.flush()
+        else:
+            self.flush_failed_step(exc_value)
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.reset()
+        if exc_type is None:
+            await sync_to_async(self.flush)()
+        else:
+            await sync_to_async(self.flush_failed_step)(exc_value)
+
+    def flush_failed_step(self, error):
+        """Writes what can be written of a step that raised ``error``. Errors of the
+        writes are logged, so that ``error`` propagates."""
+        try:
+            self.flush()
+        except Exception:
+            logger.exception(f"Pending writes lost after {error!r}")
+
+    def reset(self):
+        if self.token is not None:
+            self.current.reset(self.token)
+            self.token = None
+
+    @classmethod
+    def flush_current(cls):
+        """Writes the pending saves of the current unit of work, if any"""
+        unit = cls.current.get()
+        if unit is not None:
+            unit.flush()
+
+    def flush(self):
+        token = self.current.set(None)  # Write through
+        try:
+            while self.pending:
+                instance, fields = self.pending.pop(next(iter(self.pending)))
+                instance.save(update_fields=fields)
+        finally:
+            self.current.reset(token)
+
+    @classmethod
+    def defer(cls, instance, update_fields):
+        """Records the save of ``instance``. Returns ``False`` if the instance needs
+        to be saved right away."""
+        unit = cls.current.get()
+        if unit is None or instance._state.adding:
+            return False
+        unit.pending.setdefault(id(instance), (instance, set()))[1].update(
+            update_fields
+        )
+        return True
+
+    @classmethod
+    def discard(cls, instance):
+        """Forgets deferred saves of ``instance`` before it is saved right away"""
+        unit = cls.current.get()
+        if unit is not None:
+            unit.pending.pop(id(instance), None)
+
+
+def get_json_patch(vendor, field_name, data, changed, removed):
+    """Returns an expression setting the ``changed`` and removing the ``removed``
+    top-level keys of the JSON column ``field_name`` to their values in ``data``, or
+    ``None`` if the database ``vendor`` is not supported"""
+    expression = F(field_name)
+    if vendor == "postgresql":
+        for key in removed:
+            expression = Func(
+                expression,
+                Cast(Value(key), models.TextField()),
+                template="(%(expressions)s)",
+                arg_joiner=" - ",
+            )
+        for key in changed:
+            expression = Func(
+                expression,
+                Func(
+                    Cast(Value(key), models.TextField()),
+                    template="ARRAY[%(expressions)s]",
+                ),
+                Cast(Value(json.dumps(data[key])), models.JSONField()),
+                function="jsonb_set",
+            )
+    elif vendor == "sqlite":
+        if any('"' in key for key in changed + removed):
+            return None  # Not expressible as a JSON path label
+        for key in removed:
+            expression = Func(expression, Value(f'$."{key}"'), function="JSON_REMOVE")
+        for key in changed:
+            expression = Func(
+                expression,
+                Value(f'$."{key}"'),
+                Func(Value(json.dumps(data[key])), function="JSON"),
+                function="JSON_SET",
+            )
+    else:
+        return None
+    return Func(expression, template="%(expressions)s", output_field=models.JSONField())
+
+
+class PatchableJSONField(models.JSONField):
+    """JSON field that, when an existing row is updated, writes the expression in the
+    instance's ``_<attname>_patch`` attribute (see ``get_json_patch``) instead of the
+    whole value. The value itself stays untouched."""
+
+    def pre_save(self, model_instance, add):
+        patch = model_instance.__dict__.get(f"_{self.attname}_patch")
+        if patch is not None and not add:
+            return patch
+        return super().pre_save(model_instance, add)
+
+
+def get_worker_id():
+    """Identifies the current worker (host, process, and thread) for claims and locks"""
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"[-64:]
+
+
 class AutomationModel(models.Model):
     automation_class = models.CharField(
         max_length=256,
@@ -40,7 +235,7 @@ class AutomationModel(models.Model):
         default=False,
         verbose_name=_("Finished"),
     )
-    data = models.JSONField(
+    data = PatchableJSONField(
         verbose_name=_("Data"),
         default=dict,
     )
@@ -49,22 +244,195 @@ class AutomationModel(models.Model):
         default="",
         max_length=64,
     )
+    fingerprint = models.CharField(
+        verbose_name=_("Uniqueness fingerprint"),
+        default="",
+        blank=True,
+        max_length=64,
+        db_index=True,
+        help_text=_("Hash of the automation class and the values of its unique keys"),
+    )
     paused_until = models.DateTimeField(
         null=True,
         verbose_name=_("Paused until"),
     )
+    priority = models.IntegerField(
+        default=0,
+        verbose_name=_("Priority"),
+    )
+    queue = models.CharField(
+        max_length=64,
+        default="default",
+        db_index=True,
+        verbose_name=_("Queue"),
+    )
     created = models.DateTimeField(
         auto_now_add=True,
     )
     updated = models.DateTimeField(
         auto_now=True,
+        db_index=True,
+    )
+    claimed_by = models.CharField(
+        verbose_name=_("Claimed by"),
+        default="",
+        blank=True,
+        max_length=64,
+    )
+    claimed_until = models.DateTimeField(
+        null=True,
+        verbose_name=_("Claimed until"),
     )
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["finished", "paused_until"]),
+            models.Index(fields=["finished", "priority", "automation_class"]),
+        ]
+        constraints = [
+            models.UniqueConstraint(  # Where supported: one running automation per key
+                fields=["fingerprint"],
+                condition=Q(finished=False) & ~Q(fingerprint=""),
+                name="automations_unique_fingerprint",
+            ),
+        ]
+
     _automation_class = None
+    _claim_fields = ("claimed_by", "claimed_until")
+    _snapshot = None  # Field values when loaded or last saved
+    _data_patch = None  # Expression writing the changed keys of data
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._snapshot = instance.get_snapshot()
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using, fields, **kwargs)
+        snapshot = self.get_snapshot()
+        if fields is not None and self._snapshot is not None:  # Keep other fields
+            snapshot = {
+                **self._snapshot,
+                **{name: snapshot[name] for name in fields if name in snapshot},
+            }
+        self._snapshot = snapshot
+
+    @staticmethod
+    def dump(value):
+        return json.dumps(value, sort_keys=True)
+
+    def get_snapshot(self):
+        snapshot = {
+            field.attname: getattr(self, field.attname)
+            for field in self._meta.concrete_fields
+            if field.attname in self.__dict__ and field.name != "data"
+        }
+        if isinstance(self.__dict__.get("data"), dict):  # JSON of each top-level key
+            snapshot["data"] = {
+                key: self.dump(value) for key, value in self.data.items()
+            }
+        return snapshot
+
+    def get_changed_data(self):
+        """Returns the top-level keys of ``data`` changed since the instance was loaded
+        or last saved and the keys removed, or ``None`` if unknown"""
+        if self._snapshot is None or "data" not in self._snapshot:
+            return None
+        if not isinstance(self.data, dict):
+            return None
+        saved = self._snapshot["data"]
+        changed = [
+            key
+            for key, value in self.data.items()
+            if key not in saved or saved[key] != self.dump(value)
+        ]
+        return changed, [key for key in saved if key not in self.data]
+
+    def merge_data(self):
+        """Reloads ``data`` written by other instances of the same row and applies the
+        unsaved changes of this instance on top"""
+        changes = self.get_changed_data()
+        data = self.data
+        self.refresh_from_db(fields=["data"])
+        if changes is not None:
+            changed, removed = changes
+            self.data.update({key: data[key] for key in changed})
+            for key in removed:
+                self.data.pop(key, None)
+
+    def get_dirty_fields(self):
+        """Returns the names of the fields changed since the instance was loaded or last
+        saved (all fields if unknown). ``updated`` is always included."""
+        fields = get_update_fields(self, self._claim_fields)
+        if self._snapshot is None:
+            return fields
+        dirty = []
+        for name in fields:
+            attname = self._meta.get_field(name).attname
+            if name == "updated":
+                dirty.append(name)
+            elif name == "data":
+                if self.get_changed_data() != ([], []):
+                    dirty.append(name)
+            elif attname not in self._snapshot or self._snapshot[attname] != getattr(
+                self, attname
+            ):
+                dirty.append(name)
+        return dirty
 
     def save(self, *args, **kwargs):
         self.key = self.get_key()
-        return super().save(*args, **kwargs)
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            # Only write changes and never overwrite a claim held by a worker with
+            # a stale value
+            kwargs["update_fields"] = self.get_dirty_fields()
+        if UnitOfWork.defer(self, kwargs.get("update_fields")):
+            return None
+        if not self._state.adding and "data" in kwargs.get("update_fields", ()):
+            changes = self.get_changed_data()
+            if changes == ([], []):  # Data unchanged
+                kwargs["update_fields"] = [
+                    name for name in kwargs["update_fields"] if name != "data"
+                ]
+            elif changes is not None:  # Only write the changed keys
+                self._data_patch = get_json_patch(
+                    connection.vendor, "data", self.data, *changes
+                )
+        try:
+            super().save(*args, **kwargs)
+        finally:
+            self._data_patch = None
+        self._snapshot = self.get_snapshot()
+
+    @classmethod
+    def create_all(cls, instances):
+        """Inserts ``instances`` and stores their keys with two statements"""
+        if not instances:
+            return instances
+        if not connection.features.can_return_rows_from_bulk_insert:
+            for instance in instances:  # Keys need the primary key
+                instance.save()
+                instance.key = instance.get_key()
+                cls.objects.filter(pk=instance.pk).update(key=instance.key)
+            return instances
+        instances = cls.objects.bulk_create(instances)
+        for instance in instances:
+            instance.key = instance.get_key()
+        table, key, pk = (
+            connection.ops.quote_name(name)
+            for name in (
+                cls._meta.db_table,
+                cls._meta.get_field("key").column,
+                cls._meta.pk.column,
+            )
+        )
+        with connection.cursor() as cursor:  # Faster than bulk_update for many rows
+            cursor.executemany(
+                f"UPDATE {table} SET {key} = %s WHERE {pk} = %s",
+                [(instance.key, instance.pk) for instance in instances],
+            )
+        return instances
 
     def get_automation_class(self):
         if self._automation_class is None:
@@ -76,23 +444,284 @@ class AutomationModel(models.Model):
         return self.get_automation_class()(automation=self)
 
     @classmethod
-    def run(cls, timestamp=None):
+    def select(cls, queryset, queues=None, shard=None):
+        """Restricts ``queryset`` to automations in one of the ``queues`` and, if
+        ``shard`` is a tuple ``(i, n)``, to the i-th of n shards (by id)"""
+        if queues:
+            queryset = queryset.filter(queue__in=queues)
+        if shard is not None:
+            index, count = shard
+            queryset = queryset.annotate(shard=Mod("id", count)).filter(shard=index)
+        return queryset
+
+    @classmethod
+    def get_due(cls, timestamp=None, queues=None, shard=None):
+        """Returns a queryset of all unfinished automations which are not paused"""
+        if timestamp is None:
+            timestamp = now()
+        return cls.select(
+            cls.objects.filter(
+                finished=False,
+            ).filter(Q(paused_until__lte=timestamp) | Q(paused_until=None)),
+            queues,
+            shard,
+        )
+
+    @classmethod
+    def get_next_wakeup(cls, timestamp=None, queues=None, shard=None):
+        """Returns the earliest time after ``timestamp`` a paused automation is due
+        or ``None`` if no automation is paused"""
         if timestamp is None:
             timestamp = now()
-        automations = cls.objects.filter(
-            finished=False,
-        ).filter(Q(paused_until__lte=timestamp) | Q(paused_until=None))
-
-        for automation in automations:
-            klass = import_string(automation.automation_class)
-            instance = klass(automation_id=automation.id, autorun=False)
-            logger.info(f"Running automation {automation.automation_class}")
+        return cls.select(
+            cls.objects.filter(
+                finished=False,
+                paused_until__gt=timestamp,
+            ),
+            queues,
+            shard,
+        ).aggregate(Min("paused_until"))["paused_until__min"]
+
+    @classmethod
+    def run(
+        cls,
+        timestamp=None,
+        workers=1,
+        batch_size=None,
+        queues=None,
+        shard=None,
+        stop=None,
+    ):
+        """Runs all due automations. With more than one worker the automations are
+        distributed over a thread pool. Each worker claims its automations before running
+        them, so that several workers (on one or several hosts) never run the same
+        automation at the same time. ``queues`` and ``shard`` restrict the automations
+        to run (see ``select``). Once the ``threading.Event`` ``stop`` is set, the
+        workers finish their current automation and release the other claims."""
+        if timestamp is None:
+            timestamp = now()
+        start = time.perf_counter()
+        AutomationTaskModel.release_stale_locks()
+        if workers <= 1:
+            cls.run_worker(timestamp, batch_size, queues, shard, stop)
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [
+                    executor.submit(
+                        cls.run_worker_thread,
+                        timestamp,
+                        batch_size,
+                        queues,
+                        shard,
+                        stop,
+                    )
+                    for _ in range(workers)
+                ]
+            for future in futures:
+                future.result()  # Propagate exceptions
+        signals.automations_run.send(sender=cls, duration=time.perf_counter() - start)
+
+    @classmethod
+    def run_worker_thread(
+        cls, timestamp, batch_size=None, queues=None, shard=None, stop=None
+    ):
+        try:
+            cls.run_worker(timestamp, batch_size, queues, shard, stop)
+        finally:
+            connections.close_all()  # Only closes this thread's connections
+
+    @classmethod
+    def run_worker(cls, timestamp, batch_size=None, queues=None, shard=None, stop=None):
+        """Runs due automations one after the other (see ``claim_all``) until ``stop``
+        is set"""
+        owner = get_worker_id()
+        for automation in cls.claim_all(timestamp, owner, batch_size, queues, shard):
+            if stop is not None and stop.is_set():
+                cls.release_claims(owner)  # Claimed but not run
+                break
             try:
-                instance.run()
-            except Exception as e:  # pragma: no cover
-                automation.finished = True
-                automation.save()
-                logger.error(f"Error: {repr(e)}", exc_info=sys.exc_info())
+                automation.run_automation()
+            finally:
+                automation.release_claim(owner, timestamp)
+
+    @classmethod
+    async def arun(
+        cls,
+        timestamp=None,
+        concurrency=100,
+        batch_size=None,
+        queues=None,
+        shard=None,
+        stop=None,
+    ):
+        """Runs all due automations on the event loop. Up to ``concurrency``
+        automations run interleaved: while one awaits an ``async def`` callable of an
+        ``Execute`` or ``If`` node the others proceed. Database access is done through
+        ``sync_to_async``. Once ``stop`` is set no further automations are started."""
+        if timestamp is None:
+            timestamp = now()
+        start = time.perf_counter()
+        await sync_to_async(AutomationTaskModel.release_stale_locks)()
+        owner = get_worker_id()
+        claimed = cls.claim_all(timestamp, owner, batch_size, queues, shard)
+        slots = asyncio.Semaphore(concurrency)
+
+        async def run_automation(automation):
+            try:
+                await automation.arun_automation()
+            finally:
+                await sync_to_async(automation.release_claim)(owner, timestamp)
+                slots.release()
+
+        running = []
+        while True:
+            await slots.acquire()
+            if stop is not None and stop.is_set():
+                slots.release()
+                break
+            automation = await sync_to_async(next)(claimed, None)
+            if automation is None:
+                slots.release()
+                break
+            running.append(asyncio.ensure_future(run_automation(automation)))
+        await asyncio.gather(*running)
+        if stop is not None and stop.is_set():
+            await sync_to_async(cls.release_claims)(owner)  # Claimed but not run
+        signals.automations_run.send(sender=cls, duration=time.perf_counter() - start)
+
+    @classmethod
+    def claim_all(cls, timestamp, owner, batch_size=None, queues=None, shard=None):
+        """Yields the due automations claimed for ``owner`` in order of their priority
+        (highest first). Within a priority the automation classes take turns: In each
+        round every automation class gets up to ``batch_size`` of its automations
+        (oldest first), so that one class with many due automations cannot starve the
+        others. The caller releases each claim after running the automation."""
+        priority = cls.get_next_priority(timestamp, queues, shard)
+        while priority is not None:
+            cursors = {
+                automation_class: 0
+                for automation_class in cls.get_due(timestamp, queues, shard)
+                .filter(priority=priority)
+                .order_by()
+                .values_list("automation_class", flat=True)
+                .distinct()
+            }
+            while cursors:
+                for automation_class, after in list(cursors.items()):
+                    last_id, automations = cls.claim_due(
+                        timestamp,
+                        owner,
+                        after,
+                        batch_size,
+                        automation_class,
+                        priority,
+                        queues,
+                        shard,
+                    )
+                    if last_id is None:  # Class done
+                        del cursors[automation_class]
+                        continue
+                    cursors[automation_class] = last_id
+                    yield from automations
+                next_priority = cls.get_next_priority(timestamp, queues, shard)
+                if next_priority is not None and next_priority > priority:
+                    break  # More urgent automations became due
+            priority = cls.get_next_priority(timestamp, queues, shard)
+
+    @classmethod
+    def get_next_priority(cls, timestamp, queues=None, shard=None):
+        """Returns the highest priority of the due automations not yet processed in
+        the run for ``timestamp``"""
+        return (
+            cls.get_due(timestamp, queues, shard)
+            .filter(Q(claimed_until=None) | Q(claimed_until__lt=timestamp))
+            .aggregate(Max("priority"))["priority__max"]
+        )
+
+    @classmethod
+    def claim_due(
+        cls,
+        timestamp,
+        owner,
+        after=0,
+        batch_size=None,
+        automation_class=None,
+        priority=None,
+        queues=None,
+        shard=None,
+    ):
+        """Claims up to ``batch_size`` due automations with an id larger than ``after``
+        (restricted to ``automation_class``, ``priority``, ``queues``, and ``shard``
+        if given).
+        Returns the largest id inspected (``None`` if there was none) and an iterator
+        over the automations claimed for ``owner``. Rows claimed by other workers are
+        skipped. Automations released during the run for ``timestamp`` are not claimed
+        again. Only ids are read to select the candidates and each claimed row is
+        loaded once, so memory stays bounded by ``batch_size``."""
+        if batch_size is None:
+            batch_size = settings.CLAIM_BATCH_SIZE
+        unclaimed = Q(claimed_until=None) | Q(claimed_until__lt=timestamp)
+        with transaction.atomic():
+            candidates = cls.get_due(timestamp, queues, shard).filter(
+                unclaimed, id__gt=after
+            )
+            if automation_class is not None:
+                candidates = candidates.filter(automation_class=automation_class)
+            if priority is not None:
+                candidates = candidates.filter(priority=priority)
+            if connection.features.has_select_for_update_skip_locked:
+                candidates = candidates.select_for_update(skip_locked=True)
+            candidates = list(
+                candidates.order_by("id").values_list("id", flat=True)[:batch_size]
+            )
+            if not candidates:
+                return None, []
+            cls.objects.filter(unclaimed, id__in=candidates).update(
+                claimed_by=owner,
+                claimed_until=now() + settings.CLAIM_LEASE,
+            )
+        return candidates[-1], (
+            cls.objects.filter(id__in=candidates, claimed_by=owner)
+            .order_by("id")
+            .iterator(chunk_size=batch_size)
+        )
+
+    @classmethod
+    def release_claims(cls, owner):
+        """Releases all claims of ``owner`` without marking the automations as
+        processed, so that the next worker runs them"""
+        return cls.objects.filter(claimed_by=owner).update(
+            claimed_by="", claimed_until=None
+        )
+
+    def release_claim(self, owner, timestamp):
+        """Releases the claim but marks the automation as processed for ``timestamp``"""
+        self.__class__.objects.filter(id=self.id, claimed_by=owner).update(
+            claimed_by="",
+            claimed_until=timestamp,
+        )
+
+    def run_automation(self):
+        klass = self.get_automation_class()
+        instance = klass(automation=self, autorun=False)  # Do not fetch row again
+        logger.info(f"Running automation {self.automation_class}")
+        try:
+            instance.run()
+        except Exception as e:  # pragma: no cover
+            self.finished = True
+            self.save()
+            logger.error(f"Error: {repr(e)}", exc_info=sys.exc_info())
+
+    async def arun_automation(self):
+        klass = self.get_automation_class()
+        instance = await sync_to_async(klass)(automation=self, autorun=False)
+        logger.info(f"Running automation {self.automation_class}")
+        try:
+            await instance.arun()
+        except Exception as e:  # pragma: no cover
+            self.finished = True
+            await sync_to_async(self.save)()
+            logger.error(f"Error: {repr(e)}", exc_info=sys.exc_info())
 
     def get_key(self):
         return hashlib.sha1(
@@ -100,16 +729,187 @@ class AutomationModel(models.Model):
         ).hexdigest()
 
     @classmethod
-    def delete_history(cls, days=30):
-        automations = cls.objects.filter(
-            finished=True, updated__lt=now() - datetime.timedelta(days=days)
+    def get_expired(cls, days=30, timestamp=None):
+        """Returns a queryset of the finished automations not updated for longer than
+        the retention period of their class (``Meta.retention_days``) or ``days``."""
+        if timestamp is None:
+            timestamp = now()
+        finished = cls.objects.filter(finished=True)
+        classes = collections.defaultdict(list)
+        for automation_class in (
+            finished.order_by().values_list("automation_class", flat=True).distinct()
+        ):
+            try:
+                retention = get_automation_class(automation_class).get_retention_days(
+                    days
+                )
+            except (ImportError, AttributeError):  # Class does not exist anymore
+                retention = days
+            if retention is not None:
+                classes[retention].append(automation_class)
+        condition = Q(pk__in=[])
+        for retention, class_names in classes.items():
+            condition |= Q(
+                automation_class__in=class_names,
+                updated__lt=timestamp - datetime.timedelta(days=retention),
+            )
+        return finished.filter(condition)
+
+    @classmethod
+    def delete_history(cls, days=30, batch_size=None, sleep=0, dry_run=False):
+        """Deletes the history of expired automations (see ``get_expired()``) in
+        batches: first their tasks, then the automations, then artifacts no task
+        refers to anymore. Returns the total number and the number per model label of
+        the (with ``dry_run``: to be) deleted objects."""
+        automations = cls.get_expired(days)
+        tasks = AutomationTaskModel.objects.filter(automation__in=automations)
+        artifacts = AutomationArtifactModel.objects.exclude(
+            automationtaskmodel__in=AutomationTaskModel.objects.exclude(
+                automation__in=automations
+            )
         )
-        return automations.delete()
+        if dry_run:
+            info_dict = {
+                queryset.model._meta.label: queryset.count()
+                for queryset in (tasks, automations, artifacts)
+            }
+            info_dict = {label: count for label, count in info_dict.items() if count}
+            return sum(info_dict.values()), info_dict
+
+        if batch_size is None:
+            batch_size = settings.DELETE_BATCH_SIZE
+        info_dict = collections.Counter()
+        while True:
+            pks = list(automations.order_by().values_list("pk", flat=True)[:batch_size])
+            if not pks:
+                break
+            info_dict.update(
+                delete_in_batches(
+                    AutomationTaskModel.objects.filter(automation_id__in=pks),
+                    batch_size,
+                    sleep,
+                )
+            )
+            info_dict.update(
+                delete_in_batches(cls.objects.filter(pk__in=pks), batch_size, sleep)
+            )
+        info_dict.update(AutomationArtifactModel.delete_unused(batch_size, sleep))
+        return sum(info_dict.values()), dict(info_dict)
+
+    @classmethod
+    def iter_archive(cls, queryset, batch_size=500):
+        """Yields a json-serializable record for each automation of ``queryset`` and
+        its tasks. Automations are read in batches of ``batch_size`` paginated by their
+        primary key, so memory use does not grow with the size of ``queryset``."""
+        queryset = queryset.order_by("pk")
+        batch = list(queryset[:batch_size])
+        while batch:
+            tasks = collections.defaultdict(list)
+            for task in (
+                AutomationTaskModel.objects.filter(automation__in=batch)
+                .select_related("artifact")
+                .order_by("pk")
+                .iterator(chunk_size=batch_size)
+            ):
+                record = serializers.serialize("python", [task])[0]
+                record["fields"].update(result=task.get_result(), artifact=None)
+                record["offload"] = task.artifact_id is not None
+                tasks[task.automation_id].append(record)
+            for automation in batch:
+                yield dict(
+                    automation=serializers.serialize("python", [automation])[0],
+                    tasks=tasks[automation.pk],
+                )
+            batch = list(queryset.filter(pk__gt=batch[-1].pk)[:batch_size])
+
+    @classmethod
+    def restore_archive(cls, records):
+        """Saves the automations and tasks of archive records (see ``iter_archive()``)
+        overwriting objects with the same primary keys. Returns the number of restored
+        automations."""
+        count = 0
+        for record in records:
+            with transaction.atomic():
+                next(serializers.deserialize("python", [record["automation"]])).save()
+                for task, obj in zip(
+                    record["tasks"], serializers.deserialize("python", record["tasks"])
+                ):
+                    obj.object.set_result(obj.object.result, task.get("offload", False))
+                    obj.save()
+            count += 1
+        return count
 
     def __str__(self):
         return f"<AutomationModel for {self.automation_class}>"
 
 
+class AutomationArtifactModel(models.Model):
+    """Compressed JSON content (e.g., large results and error reports) kept out of
+    the task table. Identical content is stored once."""
+
+    digest = models.CharField(
+        max_length=64,
+        unique=True,
+        verbose_name=_("SHA-256 digest"),
+    )
+    content = models.BinaryField(
+        verbose_name=_("Compressed content"),
+    )
+    size = models.IntegerField(
+        verbose_name=_("Size"),
+        help_text=_("Size of the uncompressed content in bytes"),
+    )
+    created = models.DateTimeField(
+        auto_now_add=True,
+    )
+
+    @classmethod
+    def store(cls, raw):
+        """Returns the artifact for the JSON string ``raw``, created if necessary. An
+        existing artifact is locked until the end of the transaction, so that
+        ``delete_unused()`` cannot delete it before a task refers to it."""
+        raw = raw.encode("utf-8")
+        artifact, created = cls.objects.select_for_update().get_or_create(
+            digest=hashlib.sha256(raw).hexdigest(),
+            defaults=dict(content=zlib.compress(raw), size=len(raw)),
+        )
+        return artifact
+
+    def load(self):
+        return json.loads(zlib.decompress(self.content))
+
+    @classmethod
+    def delete_unused(cls, batch_size=None, sleep=0):
+        """Deletes the artifacts no task refers to anymore. Artifacts a task starts to
+        refer to in the meantime (identical content is reused) are kept."""
+        if batch_size is None:
+            batch_size = settings.DELETE_BATCH_SIZE
+        unused = cls.objects.filter(
+            ~Exists(AutomationTaskModel.objects.filter(artifact=OuterRef("pk")))
+        )
+        counts = collections.Counter()
+        while True:
+            pks = list(unused.order_by().values_list("pk", flat=True)[:batch_size])
+            if not pks:
+                return counts
+            try:
+                with transaction.atomic():
+                    counts.update(unused.filter(pk__in=pks).delete()[1])
+            except (ProtectedError, IntegrityError):  # Some were reused meanwhile
+                for pk in pks:
+                    try:
+                        with transaction.atomic():
+                            counts.update(unused.filter(pk=pk).delete()[1])
+                    except (ProtectedError, IntegrityError):
+                        pass  # Reused: keep
+                unused = unused.exclude(pk__in=pks)
+            if sleep:
+                time.sleep(sleep)
+
+    def __str__(self):
+        return f"<AutomationArtifactModel {self.digest[:12]} ({self.size} bytes)>"
+
+
 class AutomationTaskModel(models.Model):
     automation = models.ForeignKey(
         AutomationModel,
@@ -121,6 +921,25 @@ class AutomationTaskModel(models.Model):
         null=True,
         verbose_name=_("Previous task"),
     )
+    split = models.ForeignKey(
+        "automations.AutomationTaskModel",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="branch_tasks",
+        verbose_name=_("Split task"),
+        help_text=_("Task of the innermost Split node this task is a branch of"),
+    )
+    split_depth = models.IntegerField(
+        default=0,
+        verbose_name=_("Split depth"),
+        help_text=_("Number of Split nodes this task is a branch of"),
+    )
+    open_branches = models.IntegerField(
+        default=0,
+        verbose_name=_("Open branches"),
+        help_text=_("Branches of a Split task that have not been joined yet"),
+    )
     status = models.CharField(
         max_length=256,
         blank=True,
@@ -130,6 +949,17 @@ class AutomationTaskModel(models.Model):
         default=0,
         verbose_name=_("Locked"),
     )
+    locked_at = models.DateTimeField(
+        null=True,
+        db_index=True,
+        verbose_name=_("Locked at"),
+    )
+    locked_by = models.CharField(
+        max_length=64,
+        default="",
+        blank=True,
+        verbose_name=_("Locked by"),
+    )
     requires_interaction = models.BooleanField(
         default=False, verbose_name=_("Requires interaction")
     )
@@ -167,6 +997,147 @@ class AutomationTaskModel(models.Model):
         blank=True,
         default=dict,
     )
+    artifact = models.ForeignKey(
+        AutomationArtifactModel,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        verbose_name=_("Result artifact"),
+        help_text=_("Large results and error reports are stored here"),
+    )
+
+    _lock_fields = ("locked", "locked_at", "locked_by")
+    _counter_fields = ("open_branches",)
+    _snapshot = None  # Field values when loaded or last saved
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._snapshot = instance.get_snapshot()
+        return instance
+
+    def get_snapshot(self):
+        """Returns the values of the loaded fields, JSON fields as JSON"""
+        return {
+            field.attname: (
+                json.dumps(getattr(self, field.attname), sort_keys=True)
+                if isinstance(field, models.JSONField)
+                else getattr(self, field.attname)
+            )
+            for field in self._meta.concrete_fields
+            if field.attname in self.__dict__
+        }
+
+    def get_dirty_fields(self, exclude=()):
+        """Returns the names of the fields except ``exclude`` changed since the
+        instance was loaded or last saved (all of them if unknown)"""
+        fields = get_update_fields(self, exclude)
+        if self._snapshot is None:
+            return fields
+        snapshot = self.get_snapshot()
+        return [
+            field.name
+            for field in self._meta.concrete_fields
+            if field.name in fields
+            and field.attname in snapshot
+            and self._snapshot.get(field.attname) != snapshot[field.attname]
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            # Only write changes. The lock is only changed by lock() and release(),
+            # the branch counter by start_branches() and close_branch()
+            kwargs["update_fields"] = self.get_dirty_fields(
+                self._lock_fields + self._counter_fields
+            )
+        if UnitOfWork.defer(self, kwargs.get("update_fields")):
+            return None
+        super().save(*args, **kwargs)
+        self._snapshot = self.get_snapshot()
+
+    def lock(self):
+        """Atomically locks the task unless it is already locked. Returns ``True``
+        if the task has been locked."""
+        lease = dict(locked_at=now(), locked_by=get_worker_id())
+        locked = self.__class__.objects.filter(id=self.id, locked__lte=0).update(
+            locked=F("locked") + 1, **lease
+        )
+        if locked:
+            self.locked += 1
+            self.locked_at, self.locked_by = lease["locked_at"], lease["locked_by"]
+        return bool(locked)
+
+    def lease_expiring(self):
+        """Returns ``True`` if more than half of the lock's lease has passed"""
+        return (
+            self.locked_at is not None
+            and now() - self.locked_at >= settings.LOCK_LEASE / 2
+        )
+
+    def renew(self):
+        """Extends the lease of the lock if it is still held by the worker which
+        locked the task. Returns ``True`` if it is."""
+        locked_at = now()
+        renewed = self.__class__.objects.filter(
+            id=self.id, locked__gt=0, locked_by=self.locked_by
+        ).update(locked_at=locked_at)
+        if renewed:
+            self.locked_at = locked_at
+        return bool(renewed)
+
+    def release(self, reset=False):
+        """Saves the task and atomically decrements the lock counter within the same
+        statement. With ``reset=True`` the lock counter is set to 0 instead. The lock
+        is left alone if it has been taken over by another worker meanwhile (see
+        ``release_stale_locks()``)."""
+        fields = self.get_dirty_fields(self._lock_fields + self._counter_fields)
+        locked = 0 if reset else self.locked - 1
+        owned = Q(locked_by=self.locked_by)  # locked_by is written last (MySQL)
+        self.locked = Case(
+            When(owned, then=Value(0) if reset else F("locked") - 1),
+            default=F("locked"),
+        )
+        self.locked_at = Case(
+            When(owned, then=Value(None, output_field=models.DateTimeField())),
+            default=F("locked_at"),
+        )
+        self.locked_by = Case(When(owned, then=Value("")), default=F("locked_by"))
+        UnitOfWork.discard(self)  # Written with the lock
+        try:
+            super().save(update_fields=fields + list(self._lock_fields))
+        finally:
+            self.locked, self.locked_at, self.locked_by = locked, None, ""
+        self._snapshot = self.get_snapshot()
+
+    def start_branches(self, count):
+        """Sets the number of open branches of a split task"""
+        self.open_branches = count
+        self.__class__.objects.filter(id=self.id).update(open_branches=count)
+
+    @classmethod
+    def close_branch(cls, split_id):
+        """Atomically decrements the number of open branches of the split task
+        ``split_id``. Returns the number of branches still open and the split task's
+        own ``split_id`` and ``split_depth``."""
+        with transaction.atomic():
+            split = cls.objects.filter(id=split_id)
+            split.update(open_branches=F("open_branches") - 1)  # Locks the row
+            return split.values_list("open_branches", "split_id", "split_depth").get()
+
+    @classmethod
+    def release_stale_locks(cls, lease=None):
+        """Releases the locks of tasks which have been locked for longer than
+        ``lease``, e.g., since their worker died. The tasks are retried when their
+        automation runs next. Returns the number of released tasks."""
+        if lease is None:
+            lease = settings.LOCK_LEASE
+        stale = cls.objects.filter(locked__gt=0, locked_at__lt=now() - lease)
+        for task in stale.values("id", "status", "locked_by"):
+            logger.warning(
+                f"Releasing stale lock of task {task['status']} ({task['id']}) "
+                f"held by {task['locked_by']}"
+            )
+        return stale.update(locked=0, locked_at=None, locked_by="")
 
     @property
     def data(self):
@@ -182,9 +1153,34 @@ class AutomationTaskModel(models.Model):
         instance = self.automation.instance
         return getattr(instance, self.status)
 
+    def set_result(self, result, artifact=False):
+        """Stores ``result`` (raises ``TypeError`` if it is not JSON serializable). It
+        goes into an artifact if ``artifact`` is true or if its JSON is larger than
+        ``ATM_ARTIFACT_THRESHOLD``."""
+        raw = json.dumps(result)
+        if artifact or len(raw) > settings.ARTIFACT_THRESHOLD:
+            with transaction.atomic():  # Refer to the artifact while it is locked
+                self.result, self.artifact = None, AutomationArtifactModel.store(raw)
+                if not self._state.adding:
+                    self.__class__.objects.filter(id=self.id).update(
+                        result=None, artifact=self.artifact
+                    )
+                    if self._snapshot is not None:  # Not to be written again
+                        snapshot = self.get_snapshot()
+                        for name in ("result", "artifact_id"):
+                            self._snapshot[name] = snapshot[name]
+        else:
+            self.result, self.artifact = result, None
+
+    def get_result(self):
+        """Returns the result, loading it from its artifact if necessary"""
+        if self.artifact_id is not None:
+            return self.artifact.load()
+        return self.result
+
     def get_previous_tasks(self):
-        if self.message == "Joined" and self.result:
-            return self.__class__.objects.filter(id__in=self.result)
+        if self.message == "Joined" and (self.result or self.artifact_id):
+            return self.__class__.objects.filter(id__in=self.get_result())
         return [self.previous] if self.previous else []
 
     def get_next_tasks(self):
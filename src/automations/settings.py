@@ -1,4 +1,5 @@
 # coding=utf-8
+import datetime
 
 from django.apps import apps as django_apps
 from django.conf import settings
@@ -24,6 +25,42 @@ TASK_LIST_TEMPLATES = getattr(
 
 AUTH_USER_MODEL = getattr(settings, "AUTH_USER_MODEL", "auth.User")
 
+CLAIM_LEASE = getattr(
+    settings,
+    "ATM_CLAIM_LEASE",
+    datetime.timedelta(minutes=10),
+)
+
+LOCK_LEASE = getattr(
+    settings,
+    "ATM_LOCK_LEASE",
+    datetime.timedelta(hours=1),
+)
+
+STEP_BUDGET = getattr(settings, "ATM_STEP_BUDGET", 1000)  # nodes per run
+
+TIME_BUDGET = getattr(settings, "ATM_TIME_BUDGET", None)  # seconds per run
+
+CLAIM_BATCH_SIZE = getattr(settings, "ATM_CLAIM_BATCH_SIZE", 100)
+
+WORKER_POLL_INTERVAL = getattr(settings, "ATM_WORKER_POLL_INTERVAL", 60)  # seconds
+
+WORKER_NUDGE_INTERVAL = getattr(settings, "ATM_WORKER_NUDGE_INTERVAL", 5)  # seconds
+
+WORKER_MAX_LIFETIME = getattr(settings, "ATM_WORKER_MAX_LIFETIME", None)  # seconds
+
+METRICS = getattr(settings, "ATM_METRICS", False)
+
+METRICS_TOKEN = getattr(settings, "ATM_METRICS_TOKEN", None)  # bearer token
+
+DELETE_BATCH_SIZE = getattr(settings, "ATM_DELETE_BATCH_SIZE", 1000)
+
+ARTIFACT_THRESHOLD = getattr(settings, "ATM_ARTIFACT_THRESHOLD", 4096)  # JSON bytes
+
+STRICT_WRITES = getattr(settings, "ATM_STRICT_WRITES", False)  # no write coalescing
+
+SPLIT_WORKERS = getattr(settings, "ATM_SPLIT_WORKERS", 4)  # threads per parallel Split
+
 
 def get_group_model(settings=settings):
     """
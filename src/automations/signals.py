@@ -0,0 +1,14 @@
+# coding=utf-8
+from django.dispatch import Signal
+
+node_step = Signal()
+"""Sent each time a node is entered, executed, or left and each time one of its
+``.SkipIf``, ``.AfterWaitingUntil``, or ``.AsSoonAs`` handlers has run. Arguments:
+``sender`` (the automation class), ``automation`` (the automation instance), ``node``
+(the node's name), ``phase`` ("enter", "execute", "leave", "skip", "wait", or "when"),
+``duration`` (in seconds), and ``outcome`` ("ok", "stopped", or "error")"""
+
+automations_run = Signal()
+"""Sent after ``AutomationModel.run()`` or ``AutomationModel.arun()`` has processed
+all due automations. Arguments: ``sender`` (the automation model class) and
+``duration`` (in seconds)"""
@@ -1,19 +1,39 @@
 # coding=utf-8
+import asyncio
 import datetime
 import inspect
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import Future
 from io import StringIO
+from unittest import skipIf
 from unittest.mock import patch
 
 import django.dispatch
+from asgiref.sync import async_to_sync
 from django import forms
 from django.contrib.auth import get_user_model
-from django.contrib.auth.models import Group
-from django.core.management import execute_from_command_line
-from django.test import Client, RequestFactory, TestCase, override_settings
+from django.contrib.auth.models import Group, Permission
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command, execute_from_command_line
+from django.db import IntegrityError, connection
+from django.db.models import QuerySet
+from django.db.transaction import atomic
+from django.test import (
+    Client,
+    RequestFactory,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+    skipUnlessDBFeature,
+)
+from django.test.utils import CaptureQueriesContext
 from django.utils.timezone import now
 from django.utils.translation import gettext as _
 
-from .. import flow, models, views
+from .. import flow, metrics, models, signals, views
 from ..flow import this
 from ..models import AutomationModel, AutomationTaskModel, get_automation_class
 
@@ -149,6 +169,20 @@ class BoundToFail(flow.Automation):
     error_node = Print("Oh dear").Next(this.not_caught)
 
 
+class PriorityAutomation(flow.Automation):
+    class Meta:
+        priority = 10
+
+    end = flow.End()
+
+
+class ReportAutomation(flow.Automation):
+    class Meta:
+        queue = "reports"
+
+    end = flow.End()
+
+
 class SingletonAutomation(flow.Automation):
     unique = True
 
@@ -165,6 +199,100 @@ class ByEmailSingletonAutomation(flow.Automation):
         pass
 
 
+class BulkAutomation(flow.Automation):
+    unique = ("user",)
+    user = User
+
+    start = flow.Execute(this.greet)
+    end = flow.End()
+
+    def greet(self, task):
+        return f"Hello {self.user.username}"
+
+
+class BulkStartTest(TestCase):
+    def setUp(self):
+        for name in ("ann", "bob", "cid"):
+            User.objects.create_user(username=name)
+
+    def test_bulk_start(self):
+        users = User.objects.order_by("id")
+        with patch.object(BulkAutomation, "_fingerprinted", True):
+            # Fetch ids, then per batch: running fingerprints, insert, set keys (and
+            # a savepoint)
+            with self.assertNumQueries(1 + 2 * (3 + 2)):
+                self.assertEqual(BulkAutomation.bulk_start(users, batch_size=2), 3)
+            with self.assertNumQueries(1 + 2 * 1):
+                self.assertEqual(BulkAutomation.bulk_start(users, batch_size=2), 0)
+        automations = AutomationModel.objects.filter(
+            automation_class=BulkAutomation.get_automation_class_name()
+        ).order_by("id")
+        self.assertEqual(
+            [automation.data["user"] for automation in automations],
+            [user.id for user in users],
+        )
+        for automation in automations:
+            self.assertEqual(automation.key, automation.get_key())
+            self.assertEqual(
+                automation.fingerprint,
+                BulkAutomation.get_fingerprint(automation.data),
+            )
+            self.assertFalse(automation.automationtaskmodel_set.exists())
+        self.assertEqual(AutomationModel.get_due().count(), 3)  # Left to the workers
+        with patch("sys.stdout", new=StringIO()):
+            AutomationModel.run()
+        self.assertFalse(AutomationModel.get_due().exists())
+
+    def test_without_returned_keys(self):
+        with patch.object(
+            type(connection.features), "can_return_rows_from_bulk_insert", False
+        ):
+            self.assertEqual(BulkAutomation.bulk_start(User.objects.all()), 3)
+        for automation in AutomationModel.objects.all():
+            self.assertEqual(automation.key, automation.get_key())
+
+    def test_run_and_due(self):
+        users = list(User.objects.order_by("id"))
+        started = BulkAutomation.bulk_start(
+            [dict(user=users[0]), dict(user=users[0]), users[1]], run=True
+        )
+        self.assertEqual(started, 2)  # Duplicates are skipped
+        results = AutomationTaskModel.objects.filter(status="start").order_by("id")
+        self.assertEqual([task.result for task in results], ["Hello ann", "Hello bob"])
+        due = now() + datetime.timedelta(hours=1)
+        self.assertEqual(BulkAutomation.bulk_start([users[2]], due=due), 1)
+        self.assertFalse(AutomationModel.get_due().exists())
+        self.assertEqual(AutomationModel.get_next_wakeup(), due)
+
+    def test_model_attribute(self):
+        with self.assertRaises(ImproperlyConfigured):
+            TestAutomation.bulk_start(User.objects.all())
+        with self.assertRaises(AssertionError):
+            SingletonAutomation.bulk_start([{}])
+        with self.assertRaises(AssertionError):
+            BulkAutomation.bulk_start([{}])  # Unique key missing
+
+    def test_started_concurrently(self):
+        users = list(User.objects.order_by("id"))
+
+        def start_concurrently():  # Another process starts ann's automation first
+            if not AutomationModel.objects.exists():
+                BulkAutomation(user=users[0], autorun=False)
+                raise IntegrityError
+            return atomic()
+
+        with patch.object(BulkAutomation, "_fingerprinted", True), patch(
+            "automations.flow.atomic", side_effect=start_concurrently
+        ):
+            self.assertEqual(BulkAutomation.bulk_start(users[:2]), 1)
+        self.assertEqual(
+            sorted(
+                automation.data["user"] for automation in AutomationModel.objects.all()
+            ),
+            [users[0].id, users[1].id],
+        )
+
+
 class ModelTestCase(TestCase):
     def test_modelsetup(self):
         x = TestAutomation(autorun=False)
@@ -209,6 +337,47 @@ class AutomationTestCase(TestCase):
         self.assertEqual(atm.get_verbose_name(), "Allow to split and join")
         self.assertEqual(atm.get_verbose_name_plural(), "Allow splitS and joinS")
 
+    def test_split_ancestry(self):
+        with patch("sys.stdout", new=StringIO()), patch.object(
+            flow.Join, "get_split", side_effect=AssertionError("history walked")
+        ):
+            atm = TestSplitJoin()
+        tasks = {
+            task.status: task
+            for task in atm._db.automationtaskmodel_set.exclude(message="Open Join")
+        }
+        split = tasks["split"]
+        split_again = tasks["split_again"]
+        self.assertEqual((split.split, split.split_depth), (None, 0))
+        self.assertEqual((split_again.split, split_again.split_depth), (split, 1))
+        self.assertEqual(split.open_branches, 0)
+        self.assertEqual(split_again.open_branches, 0)
+        for name in ("t10", "t20", "t30"):
+            self.assertEqual(tasks[name].split, split)
+        for name in ("t40", "t50"):
+            self.assertEqual(tasks[name].split, split_again)
+            self.assertEqual(tasks[name].split_depth, 2)
+        # The last branch to arrive continues in the enclosing split
+        self.assertEqual(tasks["join_again"].split, split)
+        self.assertEqual(tasks["going_back"].split_depth, 1)
+        joined = tasks["join"]
+        self.assertEqual((joined.split, joined.split_depth), (None, 0))
+        self.assertEqual(len(joined.result), 3)
+        self.assertEqual(tasks["l20"].split, None)
+
+    def test_join_by_history(self):
+        def forget_branches(task, count):  # Split tasks created before ancestry
+            task.branch_tasks.update(split=None, split_depth=0)
+
+        with patch("sys.stdout", new=StringIO()) as fake_out, patch.object(
+            AutomationTaskModel, "start_branches", autospec=True
+        ) as start_branches:
+            start_branches.side_effect = forget_branches
+            atm = TestSplitJoin()
+        self.assertEqual(fake_out.getvalue().splitlines()[-1], "l20 All joined now")
+        self.assertTrue(atm.finished())
+        self.assertFalse(atm._db.automationtaskmodel_set.exclude(split=None).exists())
+
 
 class FormTestCase(TestCase):
     def setUp(self):
@@ -228,8 +397,11 @@ class FormTestCase(TestCase):
         atm = FormTest(autorun=False)
         tasks = atm._db.automationtaskmodel_set.filter(finished=None)
         self.assertEqual(len(tasks), 0)
-        atm.form._user = dict(id=self.user.id)  # Fake User
-        atm.form2._user = dict(id=self.user.id)  # Fake User
+        # Fake User for all instances (nodes accessed through instances are copies)
+        for node in (FormTest.form, FormTest.form2):
+            patcher = patch.object(node, "_user", dict(id=self.user.id))
+            patcher.start()
+            self.addCleanup(patcher.stop)
         atm.run()
         users = atm.form.get_users_with_permission()
         self.assertEqual(len(users), 0)
@@ -293,6 +465,15 @@ class HistoryTestCase(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertIn("split_again = flow.Split()", response.content.decode("utf8"))
 
+    def test_history_loads_no_error_reports(self):
+        atm = BogusAutomation1()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f"/dashboard/{atm._db.id}")
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(
+            any("automationartifactmodel" in query["sql"] for query in queries)
+        )
+
     def test_no_traceback_test(self):
         atm = TestSplitJoin()
         response = self.client.get(
@@ -308,6 +489,17 @@ class HistoryTestCase(TestCase):
         )
         self.assertEqual(response.status_code, 200)
         self.assertIn("Darn, this is not good", response.content.decode("utf8"))
+        self.assertIn("<code>test</code>", response.content.decode("utf8"))
+
+    def test_legacy_traceback_test(self):
+        atm = TestSplitJoin()
+        task = atm._db.automationtaskmodel_set.first()
+        task.result = dict(error="Plain", html="<p>Rendered at failure time</p>")
+        task.save()
+        response = self.client.get(f"/dashboard/{atm._db.id}/traceback/{task.id}")
+        self.assertIn(
+            "<p>Rendered at failure time</p>", response.content.decode("utf8")
+        )
 
     def test_error_view(self):
         BogusAutomation1()
@@ -390,10 +582,24 @@ class RepeatTest(TestCase):
 
     def test_get_automations(self):
         self.assertEqual(len(flow.get_automations()), 0)
-        self.assertEqual(len(flow.get_automations("automations.flow")), 1)
+        # The base class is not registered
+        self.assertEqual(len(flow.get_automations("automations.flow")), 0)
         tpl = flow.get_automations("automations.tests.test_automations")
         self.assertIn("Allow to split and join", (name for _, name in tpl))
 
+    def test_registry(self):
+        name = "automations.tests.test_automations.TestSplitJoin"
+        self.assertIs(models.automation_classes[name], TestSplitJoin)
+        with patch("builtins.__import__") as mock_import:
+            self.assertIs(get_automation_class(name), TestSplitJoin)
+        mock_import.assert_not_called()
+        # Classes not registered are imported
+        self.assertIs(
+            get_automation_class("automations.flow.Automation"), flow.Automation
+        )
+        with self.assertRaises(AttributeError):  # Obsolete automation
+            get_automation_class("automations.tests.test_automations.Obsolete")
+
 
 class ManagementCommandStepTest(TestCase):
     def test_managment_step_command(self):
@@ -418,6 +624,250 @@ class ManagementCommandStepTest(TestCase):
         )
 
 
+class WorkerPoolTest(TestCase):
+    def test_workers(self):
+        threads = set()
+        barrier = threading.Barrier(3, timeout=5)  # All three workers run in parallel
+
+        def run_worker(timestamp, batch_size=None, queues=None, shard=None, stop=None):
+            threads.add(threading.get_ident())
+            barrier.wait()
+
+        with patch.object(AutomationModel, "run_worker", side_effect=run_worker):
+            execute_from_command_line(
+                ["manage.py", "automation_step", "--workers", "3", "--batch-size", "2"]
+            )
+        self.assertEqual(len(threads), 3)
+        self.assertNotIn(threading.get_ident(), threads)
+
+    def test_batches(self):
+        with patch("sys.stdout", new=StringIO()) as fake_out:
+            for __ in range(5):
+                TestSplitJoin(autorun=False)
+            with CaptureQueriesContext(connection) as queries:
+                AutomationModel.run(batch_size=2)
+        output = fake_out.getvalue().splitlines()
+        row_selects = [
+            query["sql"]
+            for query in queries.captured_queries
+            if query["sql"].startswith("SELECT")
+            and '"automations_automationmodel"."data"' in query["sql"]
+        ]
+        self.assertEqual(len(row_selects), 3)  # Each row is fetched only once
+        self.assertEqual(output.count("start Hello, this is the single thread"), 5)
+        self.assertEqual(output.count("l20 All joined now"), 5)
+        self.assertEqual(AutomationModel.objects.filter(finished=False).count(), 0)
+        self.assertEqual(AutomationModel.objects.exclude(claimed_by="").count(), 0)
+
+    def test_round_robin(self):
+        for __ in range(3):
+            TestSplitJoin(autorun=False)
+        SkipAutomation(autorun=False)
+        order = []
+
+        def run_automation(automation):
+            order.append(automation.automation_class.rsplit(".", 1)[-1])
+
+        with patch.object(AutomationModel, "run_automation", run_automation):
+            AutomationModel.run(batch_size=1)
+        self.assertEqual(
+            order, ["TestSplitJoin", "SkipAutomation", "TestSplitJoin", "TestSplitJoin"]
+        )
+
+    def test_priority(self):
+        first = TestSplitJoin(autorun=False)
+        second = TestSplitJoin(autorun=False)
+        urgent = PriorityAutomation(autorun=False)
+        second.set_priority(5)
+        self.assertEqual((first._db.priority, urgent._db.priority), (0, 10))
+        order = []
+
+        def run_automation(automation):
+            order.append(automation.id)
+
+        with patch.object(AutomationModel, "run_automation", run_automation):
+            AutomationModel.run()
+        self.assertEqual(order, [urgent.id, second.id, first.id])
+
+    def test_queues_and_shards(self):
+        atms = [TestSplitJoin(autorun=False) for __ in range(3)]
+        report = ReportAutomation(autorun=False)
+        self.assertEqual(report._db.queue, "reports")
+        order = []
+
+        def run_automation(automation):
+            order.append(automation.id)
+
+        with patch.object(AutomationModel, "run_automation", run_automation):
+            execute_from_command_line(
+                ["manage.py", "automation_step", "--queue", "reports"]
+            )
+            self.assertEqual(order, [report.id])
+            order.clear()
+            execute_from_command_line(
+                ["manage.py", "automation_step", "--queue", "default", "--shard", "1/2"]
+            )
+            self.assertEqual(order, [atm.id for atm in atms if atm.id % 2 == 1])
+        with self.assertRaises(CommandError):
+            call_command("automation_step", "--shard", "2/2")
+        with self.assertRaises(CommandError):
+            call_command("automation_step", "--shard", "1-2")
+
+    def test_stop(self):
+        atms = [TestSplitJoin(autorun=False) for __ in range(3)]
+        stop = threading.Event()
+        order = []
+
+        def run_automation(automation):
+            order.append(automation.id)
+            stop.set()  # e.g., SIGTERM while running the first automation
+
+        async def arun_automation(automation):
+            run_automation(automation)
+
+        with patch.object(AutomationModel, "run_automation", run_automation):
+            AutomationModel.run(stop=stop)
+        self.assertEqual(order, [atms[0].id])
+        self.assertEqual(AutomationModel.objects.exclude(claimed_by="").count(), 0)
+        self.assertEqual(AutomationModel.objects.filter(claimed_until=None).count(), 2)
+        stop.clear()
+        with patch.object(AutomationModel, "arun_automation", arun_automation):
+            async_to_sync(AutomationModel.arun)(concurrency=1, stop=stop)
+        self.assertEqual(len(order), 2)  # One more automation run
+        self.assertEqual(AutomationModel.objects.exclude(claimed_by="").count(), 0)
+        self.assertEqual(AutomationModel.objects.filter(claimed_until=None).count(), 2)
+
+    def test_claims(self):
+        atm = TestSplitJoin(autorun=False)
+        timestamp = now()
+        last_id, claimed = AutomationModel.claim_due(timestamp, "worker 1")
+        self.assertEqual(last_id, atm._db.id)
+        claimed = list(claimed)
+        self.assertEqual([automation.id for automation in claimed], [atm._db.id])
+        # Claimed automations are skipped by other workers ...
+        self.assertEqual(AutomationModel.claim_due(timestamp, "worker 2"), (None, []))
+        # ... and are not overwritten by saving the automation
+        atm.save()
+        claimed[0].release_claim("worker 1", timestamp)
+        # Released automations are not claimed again for the same run ...
+        self.assertEqual(AutomationModel.claim_due(timestamp, "worker 2"), (None, []))
+        # ... but for the next one
+        last_id, claimed = AutomationModel.claim_due(now(), "worker 2")
+        self.assertEqual(len(list(claimed)), 1)
+
+
+class WorkerCommandTest(TestCase):
+    def test_worker_command(self):
+        with patch("sys.stdout", new=StringIO()) as fake_out:
+            TestSplitJoin(autorun=False)
+            execute_from_command_line(
+                ["manage.py", "automation_worker", "--max-lifetime", "0"]
+            )
+        output = fake_out.getvalue().splitlines()
+        self.assertEqual(output[0], "start Hello, this is the single thread")
+        self.assertEqual(output[-1], "l20 All joined now")
+
+    def test_wakeup(self):
+        from ..management.commands.automation_worker import Command
+
+        self.assertIsNone(AutomationModel.get_next_wakeup())
+        atm = TestSplitJoin(autorun=False)
+        atm._db.paused_until = now() + datetime.timedelta(minutes=5)
+        atm.save()
+        self.assertEqual(AutomationModel.get_next_wakeup(), atm._db.paused_until)
+
+        command = Command()
+        timeout = command.get_timeout(now(), None, 3600)
+        self.assertGreater(timeout, 290)
+        self.assertLessEqual(timeout, 300)
+        self.assertEqual(command.get_timeout(now(), None, 10), 10)
+
+        command.nudge(None, None)
+        start = time.monotonic()
+        command.sleep(now(), None, 60, 60)  # Returns immediately after nudge
+        command.wakeup.clear()
+        command.sleep(now() - datetime.timedelta(minutes=1), None, 60, 0.01)
+        self.assertLess(time.monotonic() - start, 10)  # Woken up by update
+        command.stop(None, None)
+        self.assertTrue(command.stopping)
+
+
+class TakenOverAutomation(flow.Automation):
+    start = flow.Execute(this.take_over)
+    end = flow.End()
+
+    def take_over(self, task):  # Lock released as stale and taken by another worker
+        AutomationTaskModel.objects.filter(id=task.id).update(locked_by="other")
+
+
+class TaskLockTest(TestCase):
+    def test_lock(self):
+        atm = TestSplitJoin(autorun=False)
+        task = atm._db.automationtaskmodel_set.create(status="start")
+        other = AutomationTaskModel.objects.get(id=task.id)  # e.g., other worker
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(task.lock())
+        self.assertEqual(len(queries), 1)
+        self.assertFalse(other.lock())
+
+        other.message = "Stale"
+        other.save()  # Does not overwrite the lock
+        task.refresh_from_db()
+        self.assertEqual(task.locked, 1)
+
+        task.release()
+        self.assertEqual(task.locked, 0)
+        self.assertEqual(AutomationTaskModel.objects.get(id=task.id).locked, 0)
+        self.assertTrue(other.lock())
+        other.release(reset=True)
+        self.assertEqual(AutomationTaskModel.objects.get(id=task.id).locked, 0)
+
+    def test_taken_over(self):
+        atm = TestSplitJoin(autorun=False)
+        task = atm.start.enter()
+        self.assertTrue(task.renew())
+        AutomationTaskModel.objects.filter(id=task.id).update(locked_by="other")
+        self.assertFalse(task.renew())
+        task.message = "Late"
+        task.release()
+        task.refresh_from_db()
+        self.assertEqual(
+            (task.message, task.locked, task.locked_by), ("Late", 1, "other")
+        )
+
+        with patch("automations.settings.LOCK_LEASE", datetime.timedelta(0)):
+            with self.assertLogs("automations.flow", level="WARNING"):
+                atm = TakenOverAutomation()  # Runs
+        self.assertFalse(atm.finished())
+        task = atm._db.automationtaskmodel_set.get()  # Not left
+        self.assertEqual((task.finished, task.locked_by), (None, "other"))
+
+    def test_stale_locks(self):
+        with patch("sys.stdout", new=StringIO()) as fake_out:
+            atm = TestSplitJoin(autorun=False)
+            task = atm.start.enter()  # Worker dies after entering the first node
+            self.assertEqual(task.locked, 1)
+            self.assertEqual(task.locked_by, models.get_worker_id())
+            AutomationModel.run()
+            self.assertEqual(fake_out.getvalue(), "")  # Automation is stuck
+            self.assertEqual(AutomationTaskModel.release_stale_locks(), 0)
+
+            AutomationTaskModel.objects.filter(id=task.id).update(
+                locked_at=now() - datetime.timedelta(days=1)
+            )
+            with self.assertLogs("automations.models", level="WARNING"):
+                self.assertEqual(AutomationTaskModel.release_stale_locks(), 1)
+            task.refresh_from_db()
+            self.assertEqual(
+                (task.locked, task.locked_at, task.locked_by), (0, None, "")
+            )
+            AutomationModel.run()  # Retries task
+        output = fake_out.getvalue().splitlines()
+        self.assertEqual(output[0], "start Hello, this is the single thread")
+        self.assertEqual(output[-1], "l20 All joined now")
+
+
 class ManagementCommandDeleteTest(TestCase):
     def test_managment_delete_command(self):
         with patch("sys.stdout", new=StringIO()) as fake_out:
@@ -434,6 +884,163 @@ class ManagementCommandDeleteTest(TestCase):
         atm.kill()
 
 
+class HistoryAutomation(flow.Automation):
+    start = flow.Execute(this.init)
+    end = flow.End()
+
+    def init(self, task):
+        self.data["init"] = True
+
+
+class KeptAutomation(flow.Automation):
+    end = flow.End()
+
+    class Meta:
+        retention_days = None
+
+
+class ShortLivedAutomation(flow.Automation):
+    end = flow.End()
+
+    class Meta:
+        retention_days = 1
+
+
+class DeleteHistoryTest(TestCase):
+    def setUp(self):
+        self.automations = [
+            cls() for cls in (HistoryAutomation, KeptAutomation, ShortLivedAutomation)
+        ]
+        AutomationModel.objects.update(updated=now() - datetime.timedelta(days=2))
+
+    def test_retention(self):
+        self.assertEqual(
+            set(
+                AutomationModel.get_expired(1).values_list(
+                    "automation_class", flat=True
+                )
+            ),
+            {
+                HistoryAutomation.get_automation_class_name(),
+                ShortLivedAutomation.get_automation_class_name(),
+            },
+        )
+        self.assertEqual(
+            list(
+                AutomationModel.get_expired(30).values_list(
+                    "automation_class", flat=True
+                )
+            ),
+            [ShortLivedAutomation.get_automation_class_name()],
+        )
+
+    def test_dry_run(self):
+        tasks = AutomationTaskModel.objects.count()
+        total, info_dict = AutomationModel.delete_history(30, dry_run=True)
+        self.assertEqual(
+            info_dict,
+            {"automations.AutomationModel": 1, "automations.AutomationTaskModel": 1},
+        )
+        self.assertEqual(total, 2)
+        self.assertEqual(AutomationTaskModel.objects.count(), tasks)
+
+    def test_batches(self):
+        with CaptureQueriesContext(connection) as queries:
+            total, info_dict = AutomationModel.delete_history(1, batch_size=1)
+        self.assertEqual(
+            info_dict,
+            {"automations.AutomationModel": 2, "automations.AutomationTaskModel": 3},
+        )
+        deletes = [
+            query["sql"] for query in queries if query["sql"].startswith("DELETE")
+        ]
+        self.assertEqual(len(deletes), 5)  # One object per query
+        self.assertEqual(AutomationModel.objects.count(), 1)
+
+    def test_command(self):
+        out = StringIO()
+        call_command("automation_delete_history", "0", "--dry-run", stdout=out)
+        self.assertIn("5 total objects to be deleted", out.getvalue())
+        self.assertEqual(AutomationModel.objects.count(), 3)
+
+
+class ArchiveTest(TestCase):
+    def setUp(self):
+        self.automations = [
+            cls() for cls in (HistoryAutomation, ShortLivedAutomation, BogusAutomation1)
+        ]
+        AutomationModel.objects.update(updated=now() - datetime.timedelta(days=2))
+        self.media_root = tempfile.TemporaryDirectory()
+        media_root = override_settings(MEDIA_ROOT=self.media_root.name)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        self.addCleanup(self.media_root.cleanup)
+
+    def test_keyset_pagination(self):
+        with CaptureQueriesContext(connection) as queries:
+            records = list(
+                AutomationModel.iter_archive(AutomationModel.objects.all(), 2)
+            )
+        self.assertEqual(
+            [record["automation"]["pk"] for record in records],
+            sorted(atm._db.pk for atm in self.automations),
+        )
+        self.assertEqual(len(queries), 2 + 2 + 1)  # Two batches and the last page
+
+    def test_archive_and_import(self):
+        expected = {
+            automation.pk: (
+                automation.automation_class,
+                automation.data,
+                [
+                    (task.status, task.message, task.get_result())
+                    for task in automation.automationtaskmodel_set.order_by("pk")
+                ],
+            )
+            for automation in AutomationModel.objects.all()
+        }
+        out = StringIO()
+        call_command(
+            "automation_archive", "1", "--output", "audit.jsonl.gz", stdout=out
+        )
+        self.assertEqual(
+            out.getvalue(), "3 AutomationModel instances archived to audit.jsonl.gz\n"
+        )
+        AutomationModel.delete_history(1)
+        self.assertEqual(AutomationModel.objects.count(), 0)
+        self.assertEqual(models.AutomationArtifactModel.objects.count(), 0)
+
+        call_command("automation_import", "audit.jsonl.gz", stdout=out)
+        self.assertIn("3 AutomationModel instances restored", out.getvalue())
+        restored = {
+            automation.pk: (
+                automation.automation_class,
+                automation.data,
+                [
+                    (task.status, task.message, task.get_result())
+                    for task in automation.automationtaskmodel_set.order_by("pk")
+                ],
+            )
+            for automation in AutomationModel.objects.all()
+        }
+        self.assertEqual(restored, expected)
+        self.assertTrue(models.AutomationArtifactModel.objects.exists())
+
+    def test_zstd(self):
+        try:
+            import zstandard  # noqa: F401
+        except ImportError:
+            with self.assertRaises(CommandError):
+                call_command("automation_archive", "1", "--output", "audit.jsonl.zst")
+            return
+        call_command(
+            "automation_archive", "1", "--output", "audit.jsonl.zst", stdout=StringIO()
+        )
+        AutomationModel.delete_history(1)
+        call_command("automation_import", "audit.jsonl.zst", stdout=StringIO())
+        self.assertEqual(AutomationModel.objects.count(), 3)
+
+
 class ExecutionErrorTest(TestCase):
     def test_managment_command(self):
         with patch("sys.stdout", new=StringIO()) as fake_out:
@@ -486,6 +1093,54 @@ class SingletonTest(TestCase):
         )
         self.assertEqual(inst2._db, inst3._db)
 
+    def test_fingerprint(self):
+        inst1 = ByEmailSingletonAutomation(email="none@nowhere.com", autorun=False)
+        inst2 = ByEmailSingletonAutomation(email="nowhere@none.com", autorun=False)
+        self.assertEqual(len(inst1._db.fingerprint), 40)
+        self.assertNotEqual(inst1._db.fingerprint, inst2._db.fingerprint)
+        with self.assertNumQueries(1):  # One indexed lookup
+            inst3 = ByEmailSingletonAutomation(email="none@nowhere.com", autorun=False)
+        self.assertEqual(inst1._db, inst3._db)
+        with self.assertRaises(IntegrityError), atomic():
+            AutomationModel.objects.create(
+                automation_class=inst1.get_automation_class_name(),
+                fingerprint=inst1._db.fingerprint,
+            )
+        inst1._db.finished = True  # Finished automations do not count
+        inst1._db.save()
+        inst4 = ByEmailSingletonAutomation(email="none@nowhere.com", autorun=False)
+        self.assertNotEqual(inst1._db, inst4._db)
+        self.assertEqual(inst1._db.fingerprint, inst4._db.fingerprint)
+
+    def test_unfingerprinted(self):
+        atm_name = ByEmailSingletonAutomation.get_automation_class_name()
+        legacy, other, keyless = (
+            AutomationModel.objects.create(automation_class=atm_name, data=data)
+            for data in (
+                dict(email="none@nowhere.com"),
+                dict(email="other@nowhere.com"),
+                dict(),
+            )
+        )
+        with patch.object(ByEmailSingletonAutomation, "_fingerprinted", False):
+            inst = ByEmailSingletonAutomation(email="none@nowhere.com", autorun=False)
+            self.assertEqual(inst._db, legacy)
+            self.assertTrue(ByEmailSingletonAutomation._fingerprinted)
+            for instance in (legacy, other):  # All legacy rows are backfilled
+                instance.refresh_from_db()
+                self.assertEqual(
+                    instance.fingerprint,
+                    ByEmailSingletonAutomation.get_fingerprint(instance.data),
+                )
+            keyless.refresh_from_db()
+            self.assertEqual(keyless.fingerprint, "")
+            with self.assertNumQueries(1):  # No further scans
+                inst = ByEmailSingletonAutomation(
+                    email="other@nowhere.com", autorun=False
+                )
+            self.assertEqual(inst._db, other)
+        keyless.delete()
+
         self.assertTrue(
             ByEmailSingletonAutomation.satisfies_data_requirements(
                 "test", dict(email="test", mails="2")
@@ -574,22 +1229,86 @@ class ErrorTest(TestCase):
         )
         self.assertIn(
             "error",
-            atm._db.automationtaskmodel_set.all()[1].result,
-        )
-        self.assertIn(
-            "html",
-            atm._db.automationtaskmodel_set.all()[1].result,
+            atm._db.automationtaskmodel_set.all()[1].get_result(),
         )
+        report = atm._db.automationtaskmodel_set.all()[1].get_result()
+        self.assertNotIn("html", report)
+        self.assertEqual(report["exc_type"], "SyntaxError")
+        self.assertEqual(report["exc_value"], "Darn, this is not good")
+        self.assertEqual(report["frames"][-1]["function"], "test")
         atm = BogusAutomation2()
         self.assertTrue(atm.finished())
         self.assertEqual(len(atm._db.automationtaskmodel_set.all()), 2)
-        self.assertEqual(atm._db.automationtaskmodel_set.all()[0].result, "Truth")
+        self.assertEqual(atm._db.automationtaskmodel_set.all()[0].get_result(), "Truth")
         self.assertEqual(
             atm._db.automationtaskmodel_set.all()[1].message,
             "TypeError(\"'<' not supported between instances of 'bool' and 'datetime.datetime'\")",
         )
 
 
+class ArtifactTest(TestCase):
+    def test_error_report(self):
+        atm = BogusAutomation1()
+        task = atm._db.automationtaskmodel_set.all()[1]
+        self.assertIsNone(task.result)
+        self.assertIsNotNone(task.artifact)
+        self.assertIn("error", task.get_result())
+        self.assertLess(len(task.artifact.content), task.artifact.size)
+
+    def test_threshold(self):
+        task = AutomationTaskModel()
+        with patch("automations.settings.ARTIFACT_THRESHOLD", 20):
+            task.set_result("short")
+            self.assertEqual((task.result, task.artifact), ("short", None))
+            task.set_result(["long"] * 10)
+        self.assertIsNone(task.result)
+        self.assertEqual(task.get_result(), ["long"] * 10)
+        other = AutomationTaskModel()
+        other.set_result(["long"] * 10, artifact=True)
+        self.assertEqual(other.artifact, task.artifact)  # Stored once
+
+    def test_delete_reused(self):
+        atm = BogusAutomation1()
+        task = atm._db.automationtaskmodel_set.exclude(artifact=None).first()
+        artifact = task.artifact
+        task.artifact = None
+        task.save()
+        delete = QuerySet.delete
+
+        def reuse(queryset):  # A task stores identical content in the meantime
+            if queryset.model is models.AutomationArtifactModel:
+                AutomationTaskModel.objects.filter(pk=task.pk).update(artifact=artifact)
+            return delete(queryset)
+
+        with patch.object(QuerySet, "delete", reuse):
+            counts = models.AutomationArtifactModel.delete_unused()
+        self.assertEqual(counts["automations.AutomationArtifactModel"], 0)
+        self.assertTrue(
+            models.AutomationArtifactModel.objects.filter(pk=artifact.pk).exists()
+        )
+
+    def test_delete_while_stored(self):
+        atm = TestSplitJoin(autorun=False)
+        task = atm._db.automationtaskmodel_set.create(status="start")
+        with models.UnitOfWork():  # The task itself is saved at the end of the step
+            task.set_result(["long"] * 10, artifact=True)
+            task.save()
+            models.AutomationArtifactModel.delete_unused()
+            self.assertEqual(
+                AutomationTaskModel.objects.get(id=task.id).artifact_id,
+                task.artifact_id,
+            )
+        self.assertEqual(task.get_result(), ["long"] * 10)
+
+    def test_delete_unused(self):
+        atm = BogusAutomation1()
+        self.assertTrue(models.AutomationArtifactModel.objects.exists())
+        atm._db.finished = True
+        atm._db.save()
+        AutomationModel.delete_history(0)
+        self.assertEqual(models.AutomationArtifactModel.objects.count(), 0)
+
+
 class SkipAutomation(flow.Automation):
     start = Print("NOT SKIPPED").SkipIf(lambda x: False)
     second = (
@@ -600,6 +1319,608 @@ class SkipAutomation(flow.Automation):
     end = flow.End()
 
 
+class BudgetAutomation(flow.Automation):
+    class Meta:
+        step_budget = 2
+
+    start = Print("One")
+    second = Print("Two")
+    third = Print("Three")
+    forth = Print("Four")
+    end = flow.End()
+
+
+class BudgetTest(TestCase):
+    def test_step_budget(self):
+        with patch("sys.stdout", new=StringIO()) as fake_out:
+            atm = BudgetAutomation()
+            self.assertEqual(
+                fake_out.getvalue().splitlines(), ["start One", "second Two"]
+            )
+            self.assertFalse(atm.finished())
+            tasks = atm._db.automationtaskmodel_set.filter(finished=None)
+            self.assertEqual(
+                [(task.status, task.locked) for task in tasks], [("third", 0)]
+            )
+            AutomationModel.run()
+            AutomationModel.run()
+        output = fake_out.getvalue().splitlines()
+        self.assertEqual(output[2:], ["third Three", "forth Four"])
+        atm._db.refresh_from_db()
+        self.assertTrue(atm.finished())
+
+    def test_time_budget(self):
+        with patch("sys.stdout", new=StringIO()) as fake_out:
+            with patch.object(BudgetAutomation.Meta, "time_budget", 0, create=True):
+                BudgetAutomation()
+        self.assertEqual(fake_out.getvalue().splitlines(), ["start One"])
+
+
+class AsyncMixin:
+    in_flight = 0
+
+    async def fetch(self, task):
+        AsyncMixin.in_flight += 1
+        for __ in range(100):  # Wait for the other automations
+            if AsyncMixin.in_flight >= self.data["peers"]:
+                break
+            await asyncio.sleep(0.01)
+        return AsyncMixin.in_flight
+
+
+class AsyncAutomation(AsyncMixin, flow.Automation):
+    start = flow.Execute(this.fetch)
+    check = flow.If(this.is_ok).Then(this.report)
+    end = flow.End()
+
+    async def is_ok(self, task):
+        return True
+
+    async def report(self, task):
+        if self.data.get("fail", False):
+            raise ValueError("Report failed")
+        return "reported"
+
+
+class OtherAsyncAutomation(AsyncMixin, flow.Automation):
+    start = flow.Execute(this.fetch)
+    end = flow.End()
+
+
+class AsyncTest(TestCase):
+    def setUp(self):
+        AsyncMixin.in_flight = 0
+
+    def get_results(self, atm):
+        return [
+            (task.status, task.message, task.result)
+            for task in atm._db.automationtaskmodel_set.order_by("id")
+        ]
+
+    def test_sync_run(self):
+        atm = AsyncAutomation(peers=1)
+        self.assertTrue(atm.finished())
+        self.assertEqual(
+            self.get_results(atm),
+            [
+                ("start", "OK", 1),
+                ("check", "OK", "reported"),
+                ("end", "", {}),
+            ],
+        )
+
+    def test_arun(self):
+        atm = AsyncAutomation(peers=1, autorun=False)
+        async_to_sync(atm.arun)()
+        self.assertTrue(atm.finished())
+        self.assertEqual(
+            self.get_results(atm),
+            [
+                ("start", "OK", 1),
+                ("check", "OK", "reported"),
+                ("end", "", {}),
+            ],
+        )
+
+    def test_arun_error(self):
+        atm = AsyncAutomation(peers=1, fail=True, autorun=False)
+        async_to_sync(atm.arun)()
+        self.assertTrue(atm.finished())
+        task = atm._db.automationtaskmodel_set.get(status="check")
+        self.assertEqual(task.message, "ValueError('Report failed')")
+        self.assertIn("error", task.get_result())
+        self.assertEqual(task.locked, 0)
+
+    def test_interleaving(self):
+        automations = [
+            AsyncAutomation(peers=3, autorun=False),
+            AsyncAutomation(peers=3, autorun=False),
+            OtherAsyncAutomation(peers=3, autorun=False),
+        ]
+        call_command("automation_step", "--concurrency", "3")
+        for atm in automations:
+            atm._db.refresh_from_db()
+            self.assertTrue(atm.finished())
+            # All automations were waiting in fetch at the same time
+            self.assertEqual(self.get_results(atm)[0], ("start", "OK", 3))
+
+
+class ResumeSplit(flow.Automation):
+    start = flow.Split().Next(this.a).Next(this.b).Next(this.c)
+    a = flow.Execute(this.record).AsSoonAs(this.ready).Next(this.join)
+    b = flow.Execute(this.record).AsSoonAs(this.ready).Next(this.join)
+    c = flow.Execute(this.record).AsSoonAs(this.ready).Next(this.join)
+    join = flow.Join()
+    end = flow.End()
+
+    def ready(self, task):
+        return task.automation.data.get("ready", False)
+
+    def record(self, task):
+        assert task.automation is self._db
+        assert task.previous.automation is self._db
+        return task.previous.status
+
+
+class ResumeTest(TestCase):
+    def resume(self, atm):
+        db = AutomationModel.objects.get(id=atm._db.id)
+        with CaptureQueriesContext(connection) as queries:
+            db.run_automation()
+        return [query["sql"] for query in queries.captured_queries]
+
+    def test_waiting(self):
+        atm = ResumeSplit()
+        queries = self.resume(atm)
+        selects = [sql for sql in queries if sql.startswith("SELECT")]
+        self.assertEqual(len(selects), 1)  # Open tasks with their previous tasks
+        self.assertIn(" JOIN ", selects[0])  # Previous tasks included
+        # Per task: lock within a savepoint and release the lock
+        self.assertEqual(len(queries), 1 + 3 * 4)
+
+    def test_resume(self):
+        atm = ResumeSplit()
+        atm._db.data["ready"] = True
+        atm._db.save()
+        queries = self.resume(atm)
+        selects = [
+            sql
+            for sql in queries
+            if sql.startswith("SELECT") and "automationmodel" in sql.split("WHERE")[0]
+        ]
+        self.assertEqual(selects, [])  # The automation is never fetched again
+        atm._db.refresh_from_db()
+        self.assertTrue(atm._db.finished)
+        self.assertEqual(
+            list(
+                atm._db.automationtaskmodel_set.filter(
+                    status__in=("a", "b", "c")
+                ).values_list("result", flat=True)
+            ),
+            ["start"] * 3,
+        )
+
+    def test_arun(self):
+        atm = ResumeSplit()
+        atm._db.data["ready"] = True
+        atm._db.save()
+        db = AutomationModel.objects.get(id=atm._db.id)
+        with CaptureQueriesContext(connection) as queries:
+            async_to_sync(db.arun_automation)()
+        selects = [
+            query["sql"]
+            for query in queries.captured_queries
+            if query["sql"].startswith("SELECT")
+            and "automationmodel" in query["sql"].split("WHERE")[0]
+        ]
+        self.assertEqual(selects, [])
+        db.refresh_from_db()
+        self.assertTrue(db.finished)
+
+
+class LinearAutomation(flow.Automation):
+    start = Print("start")
+    middle = flow.Execute(this.update_data)
+    last = Print("last")
+    end = flow.End()
+
+    def update_data(self, task):
+        self.data["updated"] = True
+        self.save()
+        db = AutomationModel.objects.get(id=self._db.id)
+        return db.data.get("updated", False)  # Saved only at the end of the step
+
+
+class WriteCoalescingTest(TestCase):
+    def count_updates(self):
+        with patch("sys.stdout", new=StringIO()), CaptureQueriesContext(
+            connection
+        ) as queries:
+            atm = LinearAutomation()
+        updates = [
+            query["sql"].split()[1]
+            for query in queries.captured_queries
+            if query["sql"].startswith("UPDATE")
+        ]
+        atm._db.refresh_from_db()
+        self.assertTrue(atm._db.finished)
+        self.assertEqual(atm._db.data, dict(updated=True))
+        return atm, (
+            updates.count('"automations_automationtaskmodel"'),
+            updates.count('"automations_automationmodel"'),
+        )
+
+    def test_coalesced(self):
+        atm, updates = self.count_updates()
+        self.assertEqual(updates, (4, 2))  # One per task, two automation steps
+        self.assertEqual(
+            atm._db.automationtaskmodel_set.get(status="middle").get_result(), False
+        )
+        self.assertFalse(atm._db.automationtaskmodel_set.exclude(locked=0).exists())
+
+    def test_strict(self):
+        with patch("automations.settings.STRICT_WRITES", True):
+            atm, updates = self.count_updates()
+        self.assertEqual(updates, (4 + 3, 2))  # Results are saved separately
+        self.assertEqual(
+            atm._db.automationtaskmodel_set.get(status="middle").get_result(), True
+        )
+
+    def test_failed_step(self):
+        atm = LinearAutomation(autorun=False)
+        with self.assertRaisesMessage(ValueError, "Step failed"), self.assertLogs(
+            "automations.models", "ERROR"
+        ), patch.object(
+            AutomationModel, "save_base", side_effect=IntegrityError("Flush failed")
+        ):
+            with models.UnitOfWork():
+                atm.data["step"] = "failed"
+                atm.save()  # Deferred
+                raise ValueError("Step failed")
+
+    def test_changed_task_columns(self):
+        atm = LinearAutomation(autorun=False)
+        task = atm._db.automationtaskmodel_set.create(status="start", result=[1])
+        task = AutomationTaskModel.objects.get(id=task.id)
+        task.lock()
+        with CaptureQueriesContext(connection) as queries:
+            task.message = "OK"
+            task.save()
+            task.release()
+        save, release = (query["sql"] for query in queries.captured_queries)
+        self.assertIn('"message"', save)
+        self.assertNotIn('"result"', save + release)
+        self.assertNotIn('"interaction_permissions"', save + release)
+        self.assertIn('"locked"', release)
+        task.result.append(2)  # Changed in place
+        self.assertEqual(task.get_dirty_fields(task._lock_fields), ["result"])
+
+
+class PartialDataTest(TestCase):
+    def setUp(self):
+        self.atm = TestAutomation(autorun=False, big="x" * 1000, counter=0)
+        self.db = AutomationModel.objects.get(id=self.atm._db.id)
+
+    def save(self, db, **kwargs):
+        with CaptureQueriesContext(connection) as queries:
+            db.save(**kwargs)
+        (update,) = queries.captured_queries
+        return update["sql"]
+
+    def test_changed_keys(self):
+        other = AutomationModel.objects.get(id=self.db.id)
+        self.db.data["counter"] += 1
+        self.db.data["new"] = dict(nested=[1, 2])
+        sql = self.save(self.db)
+        self.assertIn("JSON_SET", sql)
+        self.assertNotIn("x" * 1000, sql)
+        other.data["more_participants"] = "changed"  # Concurrent change of other key
+        del other.data["big"]
+        self.save(other)
+        self.db.refresh_from_db()
+        self.assertEqual(
+            self.db.data,
+            dict(
+                more_participants="changed",
+                counter=1,
+                new=dict(nested=[1, 2]),
+            ),
+        )
+
+    def test_data_stays_dict(self):
+        seen = []
+        save_base = AutomationModel.save_base
+
+        def spy(instance, *args, **kwargs):
+            seen.append(instance.data)  # What other threads would see
+            return save_base(instance, *args, **kwargs)
+
+        self.db.data["counter"] += 1
+        with patch.object(AutomationModel, "save_base", spy):
+            sql = self.save(self.db)
+        self.assertIn("JSON_SET", sql)
+        self.assertEqual(seen, [self.db.data])
+        self.assertIsNone(self.db._data_patch)
+
+    def test_changed_columns(self):
+        self.db.paused_until = now()
+        sql = self.save(self.db)
+        self.assertIn('"paused_until"', sql)
+        self.assertNotIn('"data"', sql)
+        self.assertNotIn('"finished"', sql)
+        sql = self.save(self.db)  # Nothing changed
+        self.assertEqual(sql.split(" WHERE ")[0].count(" = "), 1)
+        self.assertIn('"updated"', sql)
+        self.db.data["big"] = "small"
+        sql = self.save(self.db, update_fields=["data"])
+        self.assertNotIn('"updated"', sql)
+        self.db.refresh_from_db()
+        self.assertEqual(self.db.data["big"], "small")
+
+    def test_whole_document(self):
+        self.db.data["more_participants"] = "changed"
+        with patch.object(connection, "vendor", "other"):
+            sql = self.save(self.db)
+        self.assertIn("x" * 1000, sql)
+        self.db.data = []  # Not a dict
+        self.save(self.db)
+        self.db.refresh_from_db()
+        self.assertEqual(self.db.data, [])
+
+    def test_postgresql_patch(self):
+        patch_expression = models.get_json_patch(
+            "postgresql", "data", dict(a=None), ["a"], ["b"]
+        )
+        sql = str(
+            AutomationModel.objects.annotate(patch=patch_expression)
+            .values("patch")
+            .query
+        )
+        self.assertIn('jsonb_set(("automations_automationmodel"."data" - ', sql)
+        self.assertIn("ARRAY[", sql)
+        self.assertIsNone(models.get_json_patch("mysql", "data", {}, [], []))
+
+
+class ParallelSplitJoin(flow.Automation):
+    start = flow.Split(parallel=True).Next(this.branch1).Next(this.branch2)
+    branch1 = flow.Execute(this.meet).Next(this.join)
+    branch2 = flow.Execute(this.meet).Next(this.join)
+    join = flow.Join()
+    end = flow.End()
+
+    barrier = threading.Barrier(2, timeout=5)  # Both branches run at the same time
+
+    def meet(self, task):
+        self.barrier.wait()
+        return threading.get_ident()
+
+
+class ParallelDataSplitJoin(flow.Automation):
+    start = flow.Split(parallel=True).Next(this.branch1).Next(this.branch2)
+    branch1 = flow.Execute(this.set_data, "first").Next(this.join)
+    branch2 = flow.Execute(this.set_data, "second").Next(this.join)
+    join = flow.Join()
+    gather = flow.Execute(this.get_keys)
+    end = flow.End()
+
+    def set_data(self, task, key):
+        self.data[key] = threading.get_ident()
+
+    def get_keys(self, task):
+        return sorted(self.data)
+
+
+class InlineExecutor:
+    """Runs the submitted calls right away in the calling thread"""
+
+    def __init__(self, max_workers=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def submit(self, fn, *args):
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as err:
+            future.set_exception(err)
+        return future
+
+
+class ParallelSplitTest(TransactionTestCase):
+    def setUp(self):
+        ParallelSplitJoin.barrier.reset()
+
+    def test_parallel_branches(self):
+        atm = ParallelSplitJoin(autorun=False)
+        branches = []
+
+        def run(branch, task=None, next_node=None):
+            ParallelSplitJoin.barrier.wait()
+            branches.append((threading.get_ident(), branch, task, next_node._name))
+
+        task = atm.start.enter()
+        with patch.object(
+            ParallelSplitJoin, "run", autospec=True, side_effect=run
+        ), patch.object(flow.Split, "is_parallel", return_value=True):
+            self.assertIsNone(atm.start.process(task))
+        self.assertEqual(len({ident for ident, *_ in branches}), 2)
+        self.assertNotIn(threading.get_ident(), {ident for ident, *_ in branches})
+        for ident, branch, prev_task, name in branches:
+            self.assertIsNot(branch, atm)  # Own node state for each branch
+            self.assertIsNot(branch._db, atm._db)  # Own model instance
+            self.assertEqual(branch._db.pk, atm._db.pk)
+            self.assertEqual(prev_task, task)
+        self.assertEqual(sorted(name for *_, name in branches), ["branch1", "branch2"])
+
+    @skipUnlessDBFeature("test_db_allows_multiple_connections")
+    @skipIf(connection.vendor == "sqlite", "SQLite runs the branches serially")
+    def test_parallel_split(self):
+        atm = ParallelSplitJoin()
+        self.assertTrue(atm.finished())
+        tasks = atm._db.automationtaskmodel_set
+        threads = {
+            task.result for task in tasks.filter(status__in=("branch1", "branch2"))
+        }
+        self.assertEqual(len(threads), 2)
+        self.assertNotIn(threading.get_ident(), threads)
+        self.assertEqual(tasks.filter(status="join", message="Joined").count(), 2)
+        self.assertEqual(tasks.filter(status="end").count(), 1)
+        self.assertFalse(tasks.exclude(locked=0).exists())
+
+    def test_branches_and_join(self):
+        with patch.object(flow, "ThreadPoolExecutor", InlineExecutor), patch.object(
+            flow.Split, "is_parallel", return_value=True
+        ):
+            atm = ParallelDataSplitJoin()
+        self.assertTrue(atm.finished())
+        tasks = atm._db.automationtaskmodel_set
+        self.assertEqual(tasks.filter(status="join", message="Joined").count(), 2)
+        self.assertEqual(tasks.filter(status="join", split=None).count(), 1)
+        self.assertEqual(tasks.get(status="start").open_branches, 0)
+        self.assertEqual(tasks.get(status="gather").result, ["first", "second"])
+        self.assertEqual(sorted(atm.data), ["first", "second"])  # Refreshed
+        self.assertFalse(tasks.exclude(locked=0).exists())
+
+    def test_merge_data(self):
+        atm = ParallelDataSplitJoin(autorun=False, kept=1)
+        first, second = (
+            AutomationModel.objects.get(pk=atm._db.pk),
+            AutomationModel.objects.get(pk=atm._db.pk),
+        )
+        first.data["first"] = 1
+        first.save()
+        second.data["second"] = 2
+        del second.data["kept"]
+        second.merge_data()
+        self.assertEqual(second.data, dict(first=1, second=2))
+        second.save()
+        first.refresh_from_db()
+        self.assertEqual(first.data, dict(first=1, second=2))
+
+    def test_sqlite_is_serial(self):
+        atm = ParallelSplitJoin(autorun=False)
+        self.assertEqual(atm.start.is_parallel(), connection.vendor != "sqlite")
+
+    def test_serial_within_transaction(self):
+        with patch("sys.stdout", new=StringIO()) as fake_out, patch.object(
+            TestSplitJoin.Meta, "parallel_splits", True, create=True
+        ), patch.object(flow, "ThreadPoolExecutor") as executor, atomic():
+            atm = TestSplitJoin()
+        self.assertTrue(atm.finished())
+        self.assertEqual(fake_out.getvalue().splitlines()[-1], "l20 All joined now")
+        executor.assert_not_called()
+
+
+class ExecutionContextTest(TestCase):
+    def test_bound_nodes(self):
+        first = AsyncAutomation(peers=1, autorun=False)
+        second = AsyncAutomation(peers=1, autorun=False)
+        self.assertIsNot(first.start, second.start)
+        self.assertIs(first.start, first.start)
+        self.assertIs(first.start._automation, first)
+        self.assertIs(second.start._automation, second)
+        task = first._db.automationtaskmodel_set.create(status="start")
+        self.assertIs(first.start.leave(task), first.check)
+        self.assertFalse(hasattr(AsyncAutomation.start, "_automation"))
+
+    def test_execution_state(self):
+        first = TestSplitJoin(autorun=False)
+        second = TestSplitJoin(autorun=False)
+        first.start._jump = "l30"  # e.g., set by If or OnError
+        task = first._db.automationtaskmodel_set.create(status="start")
+        self.assertIs(first.start.leave(task), first.l30)
+        self.assertIsNone(second.start._jump)
+        self.assertIsNone(first.start._jump)  # Only used once
+
+
+class InstrumentationTest(TestCase):
+    def setUp(self):
+        metrics.metrics.reset()
+        metrics.metrics.connect()
+        self.addCleanup(metrics.metrics.disconnect)
+
+    def test_signals(self):
+        steps, runs = [], []
+
+        def record_step(sender, automation, node, phase, duration, outcome, **kwargs):
+            self.assertIs(sender, automation.__class__)
+            self.assertGreaterEqual(duration, 0)
+            steps.append((node, phase, outcome))
+
+        def record_run(sender, duration, **kwargs):
+            runs.append(sender)
+
+        signals.node_step.connect(record_step)
+        signals.automations_run.connect(record_run)
+        try:
+            with patch("sys.stdout", new=StringIO()):
+                SkipAutomation()
+                AutomationModel.run()
+        finally:
+            signals.node_step.disconnect(record_step)
+            signals.automations_run.disconnect(record_run)
+        self.assertIn(("start", "enter", "ok"), steps)
+        self.assertIn(("start", "when", "ok"), steps)
+        self.assertIn(("start", "execute", "ok"), steps)
+        self.assertIn(("start", "leave", "ok"), steps)
+        self.assertIn(("second", "skip", "stopped"), steps)
+        self.assertIn(("end", "leave", "stopped"), steps)
+        self.assertNotIn(("second", "when", "stopped"), steps)  # Skipped
+        self.assertEqual(runs, [AutomationModel])
+
+    def test_metrics_view(self):
+        with patch("sys.stdout", new=StringIO()):
+            SkipAutomation()
+        client = Client()
+        staff = User.objects.create_user(username="staff", is_staff=True)
+        staff.user_permissions.add(
+            Permission.objects.get(codename="view_automationmodel")
+        )
+        client.force_login(staff)
+        response = client.get("/metrics")
+        self.assertEqual(response.status_code, 404)
+        with patch("automations.settings.METRICS", True):
+            response = client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        client.logout()
+        with patch("automations.settings.METRICS", True), patch(
+            "automations.settings.METRICS_TOKEN", "s3cret"
+        ):
+            response = client.get("/metrics")
+            self.assertEqual(response.status_code, 302)  # Login required
+            response = client.get("/metrics", HTTP_AUTHORIZATION="Bearer wrong")
+            self.assertEqual(response.status_code, 302)
+            response = client.get("/metrics", HTTP_AUTHORIZATION="Bearer s3cret")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], metrics.CONTENT_TYPE)
+        content = response.content.decode()
+        self.assertIn("# TYPE automations_node_steps_total counter", content)
+        self.assertIn(
+            "automations_node_steps_total{"
+            'automation="automations.tests.test_automations.SkipAutomation",'
+            'node="start",phase="execute",outcome="ok"} 1\n',
+            content,
+        )
+        self.assertIn("automations_runs_total 0\n", content)
+
+    def test_serve(self):
+        AutomationModel.run()
+        server = metrics.serve(0)
+        try:
+            with urllib.request.urlopen(
+                f"http://127.0.0.1:{server.server_address[1]}/metrics"
+            ) as response:
+                content = response.read().decode()
+        finally:
+            server.shutdown()
+        self.assertIn("automations_runs_total 1\n", content)
+
+
 class SkipTest(TestCase):
     def test_skipif(self):
         with patch("sys.stdout", new=StringIO()) as fake_out:
@@ -687,6 +2008,21 @@ class ModelSwapTestCase(TestCase):
         self.assertIn("XYZ", model_method)
 
 
+class NodelessAutomationTest(TestCase):
+    def test_run_without_nodes(self):
+        class EmptyAutomation(flow.Automation):
+            pass
+
+        class InheritedAutomation(LinearAutomation):  # Nodes are not its own
+            pass
+
+        for automation_class in (EmptyAutomation, InheritedAutomation):
+            atm = automation_class()  # Runs
+            self.assertIsNone(atm.run())
+            self.assertIsNone(async_to_sync(atm.arun)())
+            self.assertFalse(atm._db.automationtaskmodel_set.exists())
+
+
 class AutomationReprTest(TestCase):
     def test_automation_repr(self):
         class TinyAutomation(flow.Automation):
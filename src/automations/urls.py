@@ -21,4 +21,5 @@ urlpatterns = [
         views.AutomationTracebackView.as_view(),
         name="traceback",
     ),
+    path("metrics", views.MetricsView.as_view(), name="metrics"),
 ]
@@ -12,14 +12,16 @@ from django.contrib.auth.mixins import (
 from django.core.exceptions import PermissionDenied
 from django.db.models import Q
 from django.forms import BaseForm
-from django.http import Http404
+from django.http import Http404, HttpResponse
 from django.shortcuts import get_object_or_404, redirect
 from django.urls import reverse
+from django.utils.crypto import constant_time_compare
 from django.utils.timezone import now
 from django.utils.translation import gettext as _
-from django.views.generic import FormView, TemplateView
+from django.views.generic import FormView, TemplateView, View
 
 from . import flow, models, settings
+from .metrics import CONTENT_TYPE, metrics
 
 
 class AutomationMixin:
@@ -223,11 +225,15 @@ class AutomationTracebackView(PermissionRequiredMixin, TemplateView):
         task = get_object_or_404(models.AutomationTaskModel, id=kwargs.get("task_id"))
         if task.automation != automation:
             raise Http404()
-        if isinstance(task.result, dict):
+        result = task.get_result()
+        if isinstance(result, dict):
             return dict(
                 automation=automation,
-                error=task.result.get("error", None),
-                html=task.result.get("html", None),
+                error=result.get("error", None),
+                html=result.get("html", None),  # Rendered at failure time (legacy)
+                exc_type=result.get("exc_type", None),
+                exc_value=result.get("exc_value", None),
+                frames=result.get("frames", None),
             )
         return dict()
 
@@ -250,3 +256,24 @@ class AutomationErrorsView(PermissionRequiredMixin, TemplateView):
                     (task.automation, tasks.filter(automation=task.automation))
                 )
         return dict(automations=automations)
+
+
+class MetricsView(PermissionRequiredMixin, View):
+    """Exports the metrics collected by this process in the Prometheus text format.
+    Only available if ``settings.ATM_METRICS`` is set. Scrapers authenticate with the
+    bearer token ``settings.ATM_METRICS_TOKEN``, users need the view permission."""
+
+    permission_required = ("automations.view_automationmodel",)
+
+    def has_permission(self):
+        token = settings.METRICS_TOKEN
+        if token and constant_time_compare(
+            self.request.headers.get("Authorization", ""), f"Bearer {token}"
+        ):
+            return True
+        return super().has_permission()
+
+    def get(self, request, *args, **kwargs):
+        if not settings.METRICS:
+            raise Http404
+        return HttpResponse(metrics.render(), content_type=CONTENT_TYPE)